@@ -0,0 +1,180 @@
+import asyncio
+import logging
+import time
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import BadRequest, TelegramError
+
+from database import db
+from outbox import TokenBucket, outbox
+from sharding import shard
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_WORKERS = 4
+BROADCAST_RATE = 15.0
+BROADCAST_PAGE_SIZE = 50
+BROADCAST_REPORT_INTERVAL = 5.0
+BROADCAST_RETRIES = 5
+BROADCAST_RETRY_DELAY = 2.0
+
+
+class BroadcastJob:
+    def __init__(self, broadcast_id, text, last_user_id, sent, failed, total, chat_id, message_id):
+        self.id = broadcast_id
+        self.text = text
+        self.last_user_id = last_user_id
+        self.sent = sent
+        self.failed = failed
+        self.total = total
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.cancelled = False
+        self.error = None
+        self.started = time.monotonic()
+        self.done_at_start = sent + failed
+
+    @property
+    def rate(self):
+        elapsed = time.monotonic() - self.started
+        return (self.sent + self.failed - self.done_at_start) / elapsed if elapsed > 0 else 0.0
+
+
+class BroadcastService:
+    def __init__(self, database, sender, workers=BROADCAST_WORKERS, rate=BROADCAST_RATE):
+        self.db = database
+        self.sender = sender
+        self.workers = workers
+        self.bucket = TokenBucket(rate, rate)
+        self.bot = None
+        self.jobs = {}
+        self._tasks = {}
+
+    async def start(self, bot):
+        self.bot = bot
+        for row in await self.db.get_running_broadcasts(shard.index, shard.count):
+            logger.info(f"Возобновление рассылки {row[0]} после пользователя {row[2]}")
+            self._spawn(BroadcastJob(*row))
+
+    async def stop(self):
+        tasks, self._tasks = list(self._tasks.values()), {}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def begin(self, admin_id, text, chat_id, message_id):
+        total = await self.db.count_broadcast_recipients()
+        broadcast_id = await self.db.create_broadcast(admin_id, text, total, chat_id, message_id)
+        self._spawn(BroadcastJob(broadcast_id, text, 0, 0, 0, total, chat_id, message_id))
+        return broadcast_id
+
+    def cancel(self, broadcast_id):
+        job = self.jobs.get(broadcast_id)
+        if job is None:
+            return False
+        job.cancelled = True
+        return True
+
+    def _spawn(self, job):
+        self.jobs[job.id] = job
+        self._tasks[job.id] = asyncio.create_task(self._run(job))
+
+    async def _run(self, job):
+        status = 'running'
+        try:
+            reported = time.monotonic()
+            while not job.cancelled:
+                user_ids = await self._retry(job, lambda: self.db.get_broadcast_recipients(job.last_user_id, BROADCAST_PAGE_SIZE))
+                if not user_ids:
+                    break
+                await self._send_page(job, user_ids)
+                job.last_user_id = user_ids[-1]
+                await self._retry(job, lambda: self.db.save_broadcast_progress(job.id, job.last_user_id, job.sent, job.failed))
+
+                if time.monotonic() - reported >= BROADCAST_REPORT_INTERVAL:
+                    reported = time.monotonic()
+                    await self.report(job, 'running')
+
+            status = 'cancelled' if job.cancelled else 'done'
+            await self.db.finish_broadcast(job.id, status)
+            logger.info(f"Рассылка {job.id} завершена: отправлено {job.sent}, ошибок {job.failed}")
+            await self.report(job, status)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Рассылка {job.id} прервана из-за ошибки: {e}")
+            status = 'failed'
+            job.error = str(e)
+            try:
+                await self.db.finish_broadcast(job.id, status)
+            except Exception as e:
+                logger.error(f"Не удалось отметить рассылку {job.id} как прерванную: {e}")
+            await self.report(job, status)
+        finally:
+            if status != 'running':
+                self.jobs.pop(job.id, None)
+                self._tasks.pop(job.id, None)
+
+    async def _retry(self, job, call):
+        delay = BROADCAST_RETRY_DELAY
+        for attempt in range(1, BROADCAST_RETRIES + 1):
+            try:
+                return await call()
+            except Exception as e:
+                if attempt == BROADCAST_RETRIES:
+                    raise
+                logger.warning(f"Ошибка рассылки {job.id}, попытка {attempt}, повтор через {delay:.0f} с: {e}")
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    async def _send_page(self, job, user_ids):
+        pending = list(reversed(user_ids))
+
+        async def worker():
+            while pending and not job.cancelled:
+                user_id = pending.pop()
+                if await self.sender.send_now(user_id, job.text, bucket=self.bucket):
+                    job.sent += 1
+                else:
+                    job.failed += 1
+
+        await asyncio.gather(*(worker() for _ in range(self.workers)))
+
+    def render(self, job, status):
+        titles = {
+            'running': "📣 Рассылка идёт…",
+            'done': "✅ Рассылка завершена",
+            'cancelled': "⛔ Рассылка остановлена",
+            'failed': "❌ Рассылка прервана из-за ошибки",
+        }
+        text = (
+            f"{titles[status]}\n\n"
+            f"📨 Отправлено: {job.sent} из {job.total}\n"
+            f"⚠️ Ошибок: {job.failed}\n"
+            f"⚡ Скорость: {job.rate:.1f} сообщ./с"
+        )
+        if job.error:
+            text += f"\n\nПричина: {job.error}"
+        return text
+
+    async def report(self, job, status):
+        if not job.chat_id or not job.message_id:
+            return
+        if status == 'running':
+            keyboard = [[InlineKeyboardButton("⛔ Остановить", callback_data=f"broadcast_cancel_{job.id}")]]
+        else:
+            keyboard = [[InlineKeyboardButton("🔙 К модерации", callback_data="moderation_panel")]]
+        try:
+            await self.bot.edit_message_text(
+                self.render(job, status),
+                chat_id=job.chat_id,
+                message_id=job.message_id,
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+        except BadRequest:
+            pass
+        except TelegramError as e:
+            logger.error(f"Ошибка при обновлении статуса рассылки {job.id}: {e}")
+
+
+broadcasts = BroadcastService(db, outbox)
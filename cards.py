@@ -0,0 +1,136 @@
+import logging
+from collections import OrderedDict, namedtuple
+
+from database import db
+from photos import remember_file_id
+
+logger = logging.getLogger(__name__)
+
+PROFILE_CARD_CACHE_SIZE = 2048
+
+ProfileCard = namedtuple('ProfileCard', 'user_id text photo_path photo_file_id photo_hash')
+
+
+def _render_own(row):
+    return (
+        f"👤 Твоя анкета:\n\n"
+        f"📱 Имя: {row[2]} {row[3] or ''}\n"
+        f"🏫 Класс: {row[4]}\n"
+        f"⚧ Пол: {row[7]}\n"
+        f"🔍 Ищу: {row[8]}\n"
+        f"🎯 Интересы: {row[5]}\n"
+        f"📚 Любимый предмет: {row[9] or 'Не указано'}\n"
+        f"🎨 Хобби: {row[10] or 'Не указано'}\n"
+        f"💫 Мечта: {row[11] or 'Не указано'}\n"
+        f"📝 О себе: {row[6]}\n"
+    )
+
+
+def _render_public(row):
+    return (
+        f"Вот анкета для знакомства:\n\n"
+        f"👤 {row[2]} {row[3] or ''}\n"
+        f"🏫 Класс: {row[4]}\n"
+        f"⚧ Пол: {row[7]}\n"
+        f"🎯 Интересы: {row[5]}\n"
+        f"📚 Любимый предмет: {row[9] or 'Не указано'}\n"
+        f"🎨 Хобби: {row[10] or 'Не указано'}\n"
+        f"💫 Мечта: {row[11] or 'Не указано'}\n"
+        f"📝 О себе: {row[6]}\n"
+    )
+
+
+def _render_anonymous(row):
+    return (
+        f"👤 Анонимная анкета:\n\n"
+        f"🏫 Класс: {row[4]}\n"
+        f"⚧ Пол: {row[7]}\n"
+        f"🎯 Интересы: {row[5]}\n"
+        f"📚 Любимый предмет: {row[9] or 'Не указано'}\n"
+        f"🎨 Хобби: {row[10] or 'Не указано'}\n"
+        f"💫 Мечта: {row[11] or 'Не указано'}\n"
+        f"📝 О себе: {row[6]}\n\n"
+        f"💖 Поставь лайк этой анкете, и если это взаимно - узнаешь кто это!"
+    )
+
+
+def _render_match(row):
+    return (
+        f"👤 {row[2]} {row[3] or ''}\n"
+        f"📱 @{row[1] or 'без username'}\n"
+        f"🏫 Класс: {row[4]}\n"
+        f"⚧ Пол: {row[7]}\n"
+        f"🎯 Интересы: {row[5]}\n"
+        f"📚 Любимый предмет: {row[9] or 'Не указано'}\n"
+        f"🎨 Хобби: {row[10] or 'Не указано'}\n"
+        f"💫 Мечта: {row[11] or 'Не указано'}\n"
+        f"📝 О себе: {row[6]}\n"
+    )
+
+
+def _render_moderation(row):
+    return (
+        f"📋 Анкета на модерации:\n\n"
+        f"👤 Пользователь: {row[2]} {row[3] or ''}\n"
+        f"📱 @{row[1] or 'без username'}\n"
+        f"🏫 Класс: {row[4]}\n"
+        f"⚧ Пол: {row[7]}\n"
+        f"🎯 Интересы: {row[5]}\n"
+        f"📚 Любимый предмет: {row[9] or 'Не указано'}\n"
+        f"🎨 Хобби: {row[10] or 'Не указано'}\n"
+        f"💫 Мечта: {row[11] or 'Не указано'}\n"
+        f"📝 О себе: {row[6]}\n"
+        f"📅 Дата регистрации: {row[12]}\n"
+        f"🆔 ID: {row[0]}"
+    )
+
+
+RENDERERS = {
+    'own': _render_own,
+    'public': _render_public,
+    'anonymous': _render_anonymous,
+    'match': _render_match,
+    'moderation': _render_moderation,
+}
+
+
+class ProfileCardCache:
+    def __init__(self, database, size=PROFILE_CARD_CACHE_SIZE):
+        self.db = database
+        self.size = size
+        self.versions = {}
+        self.hits = 0
+        self.misses = 0
+        self._cards = OrderedDict()
+
+    def clear(self):
+        self._cards.clear()
+
+    def bump(self, user_id):
+        self.versions[user_id] = self.versions.get(user_id, 0) + 1
+
+    async def get(self, user_id, variant):
+        key = (user_id, self.versions.get(user_id, 0), variant)
+        card = self._cards.get(key)
+        if card is not None:
+            self._cards.move_to_end(key)
+            self.hits += 1
+            return card
+
+        self.misses += 1
+        row = await self.db.get_profile_card_row(user_id)
+        if not row:
+            return None
+
+        card = ProfileCard(user_id, RENDERERS[variant](row), row[13], row[14], row[15])
+        self._cards[key] = card
+        if len(self._cards) > self.size:
+            self._cards.popitem(last=False)
+        return card
+
+    async def remember_photo(self, user_id, photo, message):
+        if await remember_file_id(self.db, user_id, photo, message):
+            self.bump(user_id)
+
+
+cards = ProfileCardCache(db)
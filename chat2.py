@@ -1,13 +1,30 @@
+import asyncio
 import logging
-import sqlite3
+import multiprocessing
 import os
-from datetime import datetime
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import time
+from collections import OrderedDict
+from telegram import Bot, Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ContextTypes
 from telegram.error import BadRequest
 from telegram import InputMediaPhoto
-from threading import Thread
-from flask import Flask, request, jsonify
+from broadcast import broadcasts
+from cards import cards
+from database import db
+from dispatcher import update_processor
+from likes import likes
+from matching import candidates, eligibility, ranking, seen
+from migrations import run_migrations, check_query_plans
+from notifications import admin_digest, like_notifier
+from outbox import outbox
+from user_state import user_state
+from sharding import ShardRouter, ShardServer, shard, shard_refresher
+from web import METRICS_HOST, METRICS_PORT, WebServer
+from webhook import WEBHOOK_QUEUE_SIZE, WebhookIngress
+from photos import (
+    PHOTOS_DIR, MAX_PHOTO_BYTES, PhotoError, PhotoQueueFull, discard_incoming, incoming_path, load_photo,
+    photo_index, photo_pipeline, release_photo, save_incoming, store_photo
+)
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -15,124 +32,52 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-    BOT_TOKEN = "" # Токен и айди удалены в целях безопасности 
+BOT_TOKEN = "" # Токен и айди удалены в целях безопасности 
 
 ADMIN_IDS = []
 
-PHOTOS_DIR = "user_photos"
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET', '')
+SHARDS = int(os.environ.get('SHARDS', '1'))
+STRICT_QUERY_PLANS = os.environ.get('STRICT_QUERY_PLANS', '') == '1'
+
 if not os.path.exists(PHOTOS_DIR):
     os.makedirs(PHOTOS_DIR)
 
-app = Flask(__name__)
-
-@app.route('/')
-def home():
-    return "Бот знакомств работает! 🚀"
-
-@app.route('/health')
-def health():
-    return jsonify({"status": "ok", "timestamp": datetime.now().isoformat()})
-
-@app.route('/webhook', methods=['POST'])
-def webhook():
-    return jsonify({"status": "webhook received"})
-
-def run_flask():
-    app.run(host='0.0.0.0', port=8080, debug=False, use_reloader=False)
-
-def init_db():
-    try:
-        conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                user_id INTEGER PRIMARY KEY,
-                username TEXT,
-                first_name TEXT,
-                last_name TEXT,
-                class TEXT,
-                interests TEXT,
-                about_me TEXT,
-                gender TEXT,
-                search_gender TEXT,
-                registered_at TIMESTAMP,
-                is_active BOOLEAN DEFAULT TRUE,
-                is_approved BOOLEAN DEFAULT FALSE,
-                last_match_time TIMESTAMP,
-                photo_path TEXT,
-                favorite_subject TEXT,
-                hobby TEXT,
-                dream TEXT,
-                reported_count INTEGER DEFAULT 0,
-                last_reported TIMESTAMP
-            )
-        ''')
-
-        cursor.execute("PRAGMA table_info(users)")
-        columns = [col[1] for col in cursor.fetchall()]
-
-        if 'is_under_review' not in columns:
-            cursor.execute("ALTER TABLE users ADD COLUMN is_under_review BOOLEAN DEFAULT FALSE")
-            logger.info("Добавлена колонка is_under_review в таблицу users")
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS matches (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user1_id INTEGER,
-                user2_id INTEGER,
-                matched_at TIMESTAMP,
-                status TEXT DEFAULT 'active',
-                FOREIGN KEY (user1_id) REFERENCES users (user_id),
-                FOREIGN KEY (user2_id) REFERENCES users (user_id)
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS likes (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                from_user_id INTEGER,
-                to_user_id INTEGER,
-                liked_at TIMESTAMP,
-                is_notified BOOLEAN DEFAULT FALSE,
-                FOREIGN KEY (from_user_id) REFERENCES users (user_id),
-                FOREIGN KEY (to_user_id) REFERENCES users (user_id)
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS reports (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                reporter_id INTEGER,
-                reported_user_id INTEGER,
-                reason TEXT,
-                reported_at TIMESTAMP,
-                status TEXT DEFAULT 'pending',
-                reviewed_by INTEGER,
-                reviewed_at TIMESTAMP,
-                FOREIGN KEY (reporter_id) REFERENCES users (user_id),
-                FOREIGN KEY (reported_user_id) REFERENCES users (user_id)
-            )
-        ''')
-
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS admin_actions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                admin_id INTEGER,
-                action TEXT,
-                target_user_id INTEGER,
-                details TEXT,
-                action_at TIMESTAMP,
-                FOREIGN KEY (admin_id) REFERENCES users (user_id),
-                FOREIGN KEY (target_user_id) REFERENCES users (user_id)
-            )
-        ''')
-
-        conn.commit()
-        conn.close()
-        logger.info("База данных инициализирована")
-    except Exception as e:
-        logger.error(f"Ошибка при инициализации базы данных: {e}")
+SIMILAR_PHOTOS_SHOWN = 3
+PAGE_SIZE = 8
+PAGE_FIELD_WIDTH = 64
+PREFETCH_CACHE_SIZE = 1024
+PREFETCH_TTL = 300.0
+
+prefetched_cards = OrderedDict()
+
+webhook_ingress = WebhookIngress(WEBHOOK_SECRET, WEBHOOK_URL)
+
+def collect_metrics():
+    application = webhook_ingress.application
+    return {
+        "update_queue": application.update_queue.qsize() if application else None,
+        "webhook": {
+            "received": webhook_ingress.received,
+            "rejected": webhook_ingress.rejected,
+            "dropped": webhook_ingress.dropped,
+        },
+        "outbox": {"depth": outbox.depth, "sent": outbox.sent, "failed": outbox.failed},
+        "cards": {"hits": cards.hits, "misses": cards.misses},
+        "photos": {"pending": photo_pipeline.pending},
+        "eligible_profiles": len(eligibility.ids),
+        "broadcasts": len(broadcasts.jobs),
+        "dispatcher": update_processor.stats(),
+        "user_state": {
+            "cached": len(application.user_data) if application else None,
+            "loads": user_state.loads,
+            "writes": user_state.writes,
+            "evictions": user_state.evictions,
+        },
+    }
+
+web_server = WebServer(webhook_ingress, collect_metrics)
 
 def is_admin(user_id):
     return user_id in ADMIN_IDS
@@ -166,19 +111,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
         return
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
-
-    cursor.execute("PRAGMA table_info(users)")
-    columns = [col[1] for col in cursor.fetchall()]
-
-    if 'is_under_review' not in columns:
-        cursor.execute("ALTER TABLE users ADD COLUMN is_under_review BOOLEAN DEFAULT FALSE")
-        conn.commit()
-
-    cursor.execute("SELECT is_approved, is_under_review, is_active FROM users WHERE user_id = ?", (user_id,))
-    user = cursor.fetchone()
-    conn.close()
+    user = await db.get_user_status(user_id)
 
     if user:
         is_approved = user[0]
@@ -353,6 +286,8 @@ async def handle_profile_creation(update: Update, context: ContextTypes.DEFAULT_
         await handle_user_report(update, context)
     elif context.user_data.get('awaiting_reject_reason') or context.user_data.get('awaiting_ban_reason'):
         await handle_moderation_reason(update, context)
+    elif context.user_data.get('awaiting_broadcast_text'):
+        await handle_broadcast_text(update, context)
     else:
         await update.message.reply_text("Используй команду /start для начала работы.")
 
@@ -360,58 +295,20 @@ async def save_profile_to_db(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user_id = update.effective_user.id
     user_data = context.user_data
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
-
     try:
-        cursor.execute("PRAGMA table_info(users)")
-        columns = [col[1] for col in cursor.fetchall()]
-
-        if 'is_under_review' not in columns:
-            cursor.execute("ALTER TABLE users ADD COLUMN is_under_review BOOLEAN DEFAULT FALSE")
-            logger.info("Добавлена колонка is_under_review в таблицу users")
-
-        cursor.execute('''
-            INSERT OR REPLACE INTO users 
-            (user_id, username, first_name, last_name, class, interests, about_me, gender, search_gender, 
-             favorite_subject, hobby, dream, registered_at, is_under_review, is_approved, is_active)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            user_id,
-            update.effective_user.username,
-            user_data.get('first_name'),
-            user_data.get('last_name'),
-            user_data.get('class'),
-            user_data.get('interests'),
-            user_data.get('about_me'),
-            user_data.get('gender'),
-            user_data.get('search_gender', 'все'),
-            user_data.get('favorite_subject'),
-            user_data.get('hobby'),
-            user_data.get('dream'),
-            datetime.now(),
-            1,
-            0,
-            1
-        ))
-
-        conn.commit()
+        await db.save_profile(user_id, update.effective_user.username, user_data)
+        eligibility.update_user(user_id, is_active=True, is_approved=False, gender=user_data.get('gender'))
+        ranking.remove_profile(user_id)
+        candidates.reset(user_id)
+        drop_prefetched_card(user_id)
+        cards.bump(user_id)
 
         context.user_data.pop('profile_creation', None)
         context.user_data.pop('profile_step', None)
 
-        for admin_id in ADMIN_IDS:
-            try:
-                await context.bot.send_message(
-                    chat_id=admin_id,
-                    text=f"📋 Новая анкета на модерации!\n\n"
-                         f"Пользователь: {user_data.get('first_name')} {user_data.get('last_name') or ''}\n"
-                         f"Класс: {user_data.get('class')}\n"
-                         f"ID: {user_id}\n\n"
-                         f"Используйте панель модерации для проверки."
-                )
-            except Exception as e:
-                logger.error(f"Ошибка при отправке уведомления администратору {admin_id}: {e}")
+        admin_digest.add_profile(
+            user_id, f"{user_data.get('first_name')} {user_data.get('last_name') or ''}".strip(), user_data.get('class')
+        )
 
         keyboard = [
             [InlineKeyboardButton("📝 Посмотреть мою анкету", callback_data="view_my_profile")],
@@ -430,9 +327,6 @@ async def save_profile_to_db(update: Update, context: ContextTypes.DEFAULT_TYPE)
         logger.error(f"Ошибка при сохранении анкеты: {e}")
         await update.message.reply_text("😔 Произошла ошибка при создании анкеты. Попробуй еще раз.")
 
-    finally:
-        conn.close()
-
 async def handle_gender_selection(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -482,32 +376,16 @@ async def view_my_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     user_id = update.effective_user.id
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-    user = cursor.fetchone()
-    conn.close()
+    card = await cards.get(user_id, 'own')
 
-    if not user:
+    if not card:
         keyboard = [[InlineKeyboardButton("📝 Создать анкету", callback_data="create_profile")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         await query.edit_message_text("У тебя еще нет анкеты! Создай ее:", reply_markup=reply_markup)
         return
 
-    profile_text = (
-        f"👤 Твоя анкета:\n\n"
-        f"📱 Имя: {user[2]} {user[3] or ''}\n"
-        f"🏫 Класс: {user[4]}\n"
-        f"⚧ Пол: {user[7]}\n"
-        f"🔍 Ищу: {user[8]}\n"
-        f"🎯 Интересы: {user[5]}\n"
-        f"📚 Любимый предмет: {user[15] or 'Не указано'}\n"
-        f"🎨 Хобби: {user[16] or 'Не указано'}\n"
-        f"💫 Мечта: {user[17] or 'Не указано'}\n"
-        f"📝 О себе: {user[6]}\n"
-    )
-
-    has_photo = user[14] and os.path.exists(user[14])
+    profile_text = card.text
+    photo = await load_photo(card.photo_path, card.photo_file_id)
 
     keyboard = [
         [InlineKeyboardButton("✏️ Редактировать анкету", callback_data="edit_profile")],
@@ -516,13 +394,13 @@ async def view_my_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    if has_photo:
-        with open(user[14], 'rb') as photo:
-            await query.message.reply_photo(
-                photo=photo,
-                caption=profile_text,
-                reply_markup=reply_markup
-            )
+    if photo:
+        message = await query.message.reply_photo(
+            photo=photo,
+            caption=profile_text,
+            reply_markup=reply_markup
+        )
+        await cards.remember_photo(user_id, photo, message)
         try:
             await query.delete_message()
         except BadRequest:
@@ -572,36 +450,23 @@ async def handle_edit_profile_text(update: Update, context: ContextTypes.DEFAULT
     if not edit_field:
         return
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
+    messages = {
+        'first_name': "✅ Имя успешно обновлено!",
+        'last_name': "✅ Фамилия успешно обновлена!",
+        'class': "✅ Класс успешно обновлен!",
+        'interests': "✅ Интересы успешно обновлены!",
+        'favorite_subject': "✅ Любимый предмет успешно обновлен!",
+        'hobby': "✅ Хобби успешно обновлено!",
+        'dream': "✅ Мечта успешно обновлена!",
+        'about_me': "✅ Раздел 'О себе' успешно обновлен!"
+    }
 
     try:
-        if edit_field == 'first_name':
-            cursor.execute("UPDATE users SET first_name = ? WHERE user_id = ?", (text, user_id))
-            message = "✅ Имя успешно обновлено!"
-        elif edit_field == 'last_name':
-            cursor.execute("UPDATE users SET last_name = ? WHERE user_id = ?", (text, user_id))
-            message = "✅ Фамилия успешно обновлена!"
-        elif edit_field == 'class':
-            cursor.execute("UPDATE users SET class = ? WHERE user_id = ?", (text, user_id))
-            message = "✅ Класс успешно обновлен!"
-        elif edit_field == 'interests':
-            cursor.execute("UPDATE users SET interests = ? WHERE user_id = ?", (text, user_id))
-            message = "✅ Интересы успешно обновлены!"
-        elif edit_field == 'favorite_subject':
-            cursor.execute("UPDATE users SET favorite_subject = ? WHERE user_id = ?", (text, user_id))
-            message = "✅ Любимый предмет успешно обновлен!"
-        elif edit_field == 'hobby':
-            cursor.execute("UPDATE users SET hobby = ? WHERE user_id = ?", (text, user_id))
-            message = "✅ Хобби успешно обновлено!"
-        elif edit_field == 'dream':
-            cursor.execute("UPDATE users SET dream = ? WHERE user_id = ?", (text, user_id))
-            message = "✅ Мечта успешно обновлена!"
-        elif edit_field == 'about_me':
-            cursor.execute("UPDATE users SET about_me = ? WHERE user_id = ?", (text, user_id))
-            message = "✅ Раздел 'О себе' успешно обновлен!"
-
-        conn.commit()
+        await db.update_profile_field(user_id, edit_field, text)
+        cards.bump(user_id)
+        if edit_field in ('interests', 'hobby', 'favorite_subject') and ranking.has_profile(user_id):
+            await ranking.refresh(db, user_id)
+        message = messages[edit_field]
 
         context.user_data.pop('editing_profile', None)
         context.user_data.pop('editing_field', None)
@@ -619,9 +484,6 @@ async def handle_edit_profile_text(update: Update, context: ContextTypes.DEFAULT
         logger.error(f"Ошибка при обновлении анкеты: {e}")
         await update.message.reply_text("😔 Произошла ошибка при обновлении анкеты.")
 
-    finally:
-        conn.close()
-
 async def edit_first_name(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -790,12 +652,12 @@ async def update_gender(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     gender = 'мужской' if query.data == 'update_gender_male' else 'женский'
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
-
     try:
-        cursor.execute("UPDATE users SET gender = ? WHERE user_id = ?", (gender, user_id))
-        conn.commit()
+        await db.update_profile_field(user_id, 'gender', gender)
+        cards.bump(user_id)
+        eligibility.update_user(user_id, gender=gender)
+        candidates.reset(user_id)
+        drop_prefetched_card(user_id)
 
         keyboard = [
             [InlineKeyboardButton("📝 Посмотреть анкету", callback_data="view_my_profile")],
@@ -810,9 +672,6 @@ async def update_gender(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Ошибка при обновлении пола: {e}")
         await query.edit_message_text("😔 Произошла ошибка при обновлении пола.")
 
-    finally:
-        conn.close()
-
 async def update_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -826,12 +685,11 @@ async def update_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         search_gender = 'все'
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
-
     try:
-        cursor.execute("UPDATE users SET search_gender = ? WHERE user_id = ?", (search_gender, user_id))
-        conn.commit()
+        await db.update_profile_field(user_id, 'search_gender', search_gender)
+        cards.bump(user_id)
+        candidates.reset(user_id)
+        drop_prefetched_card(user_id)
 
         keyboard = [
             [InlineKeyboardButton("📝 Посмотреть анкету", callback_data="view_my_profile")],
@@ -849,9 +707,6 @@ async def update_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Ошибка при обновлении поиска: {e}")
         await query.edit_message_text("😔 Произошла ошибка при обновлении настроек поиска.")
 
-    finally:
-        conn.close()
-
 async def add_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -883,16 +738,39 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if context.user_data.get('awaiting_photo'):
         user_id = update.effective_user.id
 
+        photo_size = update.message.photo[-1]
+        if photo_size.file_size and photo_size.file_size > MAX_PHOTO_BYTES:
+            await update.message.reply_text("😔 Фото слишком большое. Попробуй отправить другое.")
+            return
+
         try:
-            photo_file = await update.message.photo[-1].get_file()
-            photo_path = os.path.join(PHOTOS_DIR, f"{user_id}.jpg")
-            await photo_file.download_to_drive(photo_path)
+            photo_pipeline.reserve()
+        except PhotoQueueFull:
+            await update.message.reply_text(
+                "⏳ Сейчас обрабатывается много фото. Пожалуйста, отправь фото еще раз через минуту."
+            )
+            return
 
-            conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-            cursor = conn.cursor()
-            cursor.execute("UPDATE users SET photo_path = ? WHERE user_id = ?", (photo_path, user_id))
-            conn.commit()
-            conn.close()
+        status = None
+        source_path = incoming_path(user_id, update.message.message_id)
+        try:
+            status = await update.message.reply_text("⏳ Загружаю фото...")
+            try:
+                photo_file = await photo_size.get_file()
+                await save_incoming(source_path, await photo_file.download_as_bytearray())
+            except Exception:
+                await discard_incoming(source_path)
+                raise
+
+            await status.edit_text(f"⚙️ Обрабатываю фото... (в очереди: {photo_pipeline.pending})")
+            photo_hash, photo_path = (await store_photo(db, photo_pipeline, source_path))[:2]
+
+            old_photo = await db.get_user_photo(user_id)
+            await db.set_photo(user_id, photo_path, None, photo_hash)
+            drop_prefetched_card(user_id)
+            cards.bump(user_id)
+            if old_photo and old_photo[1] != photo_hash:
+                await release_photo(db, *old_photo)
 
             context.user_data.pop('awaiting_photo', None)
 
@@ -902,11 +780,17 @@ async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ]
             reply_markup = InlineKeyboardMarkup(keyboard)
 
-            await update.message.reply_text("✅ Фото успешно добавлено в анкету!", reply_markup=reply_markup)
+            await status.edit_text("✅ Фото успешно добавлено в анкету!", reply_markup=reply_markup)
 
+        except PhotoError as e:
+            logger.warning(f"Фото пользователя {user_id} отклонено: {e}")
+            await status.edit_text("😔 Не удалось обработать это фото. Попробуй отправить другое.")
         except Exception as e:
             logger.error(f"Ошибка при сохранении фото: {e}")
-            await update.message.reply_text("😔 Произошла ошибка при сохранении фото.")
+            if status is not None:
+                await status.edit_text("😔 Произошла ошибка при сохранении фото.")
+        finally:
+            photo_pipeline.release()
     else:
         await update.message.reply_text("Для добавления фото используй кнопку 'Добавить/изменить фото' в меню.")
 
@@ -949,24 +833,11 @@ async def confirm_delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     user_id = update.effective_user.id
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
-
     try:
-        cursor.execute("SELECT photo_path FROM users WHERE user_id = ?", (user_id,))
-        user_photo = cursor.fetchone()
-
-        if user_photo and user_photo[0] and os.path.exists(user_photo[0]):
-            try:
-                os.remove(user_photo[0])
-            except Exception as e:
-                logger.error(f"Ошибка при удалении фото: {e}")
-
-        cursor.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
-        cursor.execute("DELETE FROM likes WHERE from_user_id = ? OR to_user_id = ?", (user_id, user_id))
-        cursor.execute("DELETE FROM matches WHERE user1_id = ? OR user2_id = ?", (user_id, user_id))
+        photo = await db.get_user_photo(user_id)
 
-        conn.commit()
+        await db.delete_user(user_id)
+        await forget_profile(user_id, photo)
         context.user_data.clear()
 
         keyboard = [
@@ -985,69 +856,155 @@ async def confirm_delete(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Ошибка при удалении анкеты: {e}")
         await query.edit_message_text("😔 Произошла ошибка при удалении анкеты.")
 
-    finally:
-        conn.close()
-
-async def my_likes(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def forget_profile(user_id, photo):
+    if photo:
+        await release_photo(db, *photo)
+    ranking.remove_profile(user_id)
+    eligibility.remove_user(user_id)
+    seen.reset(user_id)
+    candidates.reset(user_id)
+    drop_prefetched_card(user_id)
+    cards.bump(user_id)
+
+def clip(value, width=PAGE_FIELD_WIDTH):
+    value = str(value or '')
+    return value if len(value) <= width else value[:width - 1] + "…"
+
+async def show_page(update: Update, context: ContextTypes.DEFAULT_TYPE, kind, cursor=None, backwards=False):
     query = update.callback_query
-    await query.answer()
-
     user_id = update.effective_user.id
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        SELECT u.user_id, u.username, u.first_name, u.last_name, u.class, l.liked_at
-        FROM likes l
-        JOIN users u ON l.from_user_id = u.user_id
-        WHERE l.to_user_id = ?
-        ORDER BY l.liked_at DESC
-    ''', (user_id,))
-    likes_received = cursor.fetchall()
-
-    cursor.execute('''
-        SELECT u.user_id, u.username, u.first_name, u.last_name, u.class, l.liked_at
-        FROM likes l
-        JOIN users u ON l.to_user_id = u.user_id
-        WHERE l.from_user_id = ?
-        ORDER BY l.liked_at DESC
-    ''', (user_id,))
-    likes_given = cursor.fetchall()
-    conn.close()
-
-    likes_text = "💝 Твои лайки:\n\n"
-    if likes_received:
-        likes_text += "❤️ Лайки, которые тебе поставили:\n"
-        for like in likes_received:
-            likes_text += f"👤 {like[2]} {like[3] or ''} (@{like[1] or 'без username'})\n🏫 {like[4]}\n\n"
-    else:
-        likes_text += "❤️ Тебе еще никто не поставил лайк\n\n"
+    rows = await db.get_page(kind, user_id, cursor, backwards, PAGE_SIZE + 1)
+    if cursor is not None and not rows:
+        rows = await db.get_page(kind, user_id, None, False, PAGE_SIZE + 1)
+        cursor = None
+        backwards = False
 
-    if likes_given:
-        likes_text += "💖 Лайки, которые ты поставил:\n"
-        for like in likes_given:
-            likes_text += f"👤 {like[2]} {like[3] or ''} (@{like[1] or 'без username'})\n🏫 {like[4]}\n\n"
+    if backwards:
+        has_prev = len(rows) > PAGE_SIZE
+        has_next = True
+        rows = rows[-PAGE_SIZE:]
     else:
-        likes_text += "💖 Ты еще никому не поставил лайк\n\n"
+        has_prev = cursor is not None
+        has_next = len(rows) > PAGE_SIZE
+        rows = rows[:PAGE_SIZE]
 
     keyboard = []
-    if likes_received:
-        for like in likes_received:
-            keyboard.append([
-                InlineKeyboardButton(
-                    f"👀 Посмотреть анкету {like[2]}",
-                    callback_data=f"view_anonymous_{like[0]}"
-                )
-            ])
-
-    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="main_menu")])
+    if kind == 'matches':
+        if not rows:
+            keyboard = [
+                [InlineKeyboardButton("👀 Найти собеседника", callback_data="find_match")],
+                [InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]
+            ]
+            reply_markup = InlineKeyboardMarkup(keyboard)
+            await query.edit_message_text(
+                "😔 У тебя пока нет совпадений.\n"
+                "Продолжай ставить лайки и скоро найдутся взаимные симпатии!",
+                reply_markup=reply_markup
+            )
+            return
+        text = "💝 Твои совпадения:\n\n"
+        for match in rows:
+            keyboard.append([InlineKeyboardButton(f"👤 {clip(match[2])}", callback_data=f"view_match_{match[0]}")])
+    elif kind == 'received':
+        text = "💝 Твои лайки:\n\n"
+        text += "❤️ Лайки, которые тебе поставили:\n" if rows else "❤️ Тебе еще никто не поставил лайк\n\n"
+        for like in rows:
+            keyboard.append([InlineKeyboardButton(
+                f"👀 Посмотреть анкету {clip(like[2])}",
+                callback_data=f"view_anonymous_{like[0]}"
+            )])
+    else:
+        text = "💝 Твои лайки:\n\n"
+        text += "💖 Лайки, которые ты поставил:\n" if rows else "💖 Ты еще никому не поставил лайк\n\n"
+
+    for row in rows:
+        text += f"👤 {clip(row[2])} {clip(row[3])} (@{clip(row[1]) or 'без username'})\n🏫 {clip(row[4])}\n\n"
+
+    navigation = []
+    if has_prev and rows:
+        navigation.append(InlineKeyboardButton("⬅️ Назад", callback_data=f"page_{kind}_p_{rows[0][6]}"))
+    if has_next and rows:
+        navigation.append(InlineKeyboardButton("Далее ➡️", callback_data=f"page_{kind}_n_{rows[-1][6]}"))
+    if navigation:
+        keyboard.append(navigation)
+
+    if kind == 'received':
+        keyboard.append([InlineKeyboardButton("💖 Лайки, которые ты поставил", callback_data="page_given")])
+    elif kind == 'given':
+        keyboard.append([InlineKeyboardButton("❤️ Лайки, которые тебе поставили", callback_data="my_likes")])
+    keyboard.append([InlineKeyboardButton("🔙 В главное меню", callback_data="main_menu")])
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     try:
-        await query.edit_message_text(likes_text, reply_markup=reply_markup)
+        await query.edit_message_text(text, reply_markup=reply_markup)
     except BadRequest:
-        await query.message.reply_text(likes_text, reply_markup=reply_markup)
+        await query.message.reply_text(text, reply_markup=reply_markup)
+
+async def page_navigation(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    parts = query.data.split('_')
+    kind = parts[1]
+    if kind not in ('received', 'given', 'matches'):
+        return
+
+    cursor = None
+    backwards = False
+    if len(parts) == 4:
+        try:
+            cursor = int(parts[3])
+        except ValueError:
+            cursor = None
+        backwards = parts[2] == 'p'
+
+    await show_page(update, context, kind, cursor, backwards)
+
+async def my_likes(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    await show_page(update, context, 'received')
+
+async def prepare_match_card(user_id, search_gender):
+    card = await candidates.next_candidate(user_id, search_gender)
+    if not card:
+        return None
+
+    photo = await load_photo(card.photo_path, card.photo_file_id)
+    return card.user_id, card.text, photo
+
+def prefetch_match_card(user_id, search_gender):
+    drop_prefetched_card(user_id)
+    now = time.monotonic()
+    while prefetched_cards:
+        _, (_, task, created) = next(iter(prefetched_cards.items()))
+        if len(prefetched_cards) < PREFETCH_CACHE_SIZE and now - created < PREFETCH_TTL:
+            break
+        prefetched_cards.popitem(last=False)
+        task.cancel()
+    prefetched_cards[user_id] = (search_gender, asyncio.create_task(prepare_match_card(user_id, search_gender)), now)
+
+def drop_prefetched_card(user_id):
+    entry = prefetched_cards.pop(user_id, None)
+    if entry:
+        entry[1].cancel()
+
+async def take_match_card(user_id, search_gender):
+    entry = prefetched_cards.pop(user_id, None)
+    if entry and entry[0] == search_gender and time.monotonic() - entry[2] < PREFETCH_TTL:
+        try:
+            match_card = await entry[1]
+        except Exception as e:
+            logger.error(f"Ошибка при подготовке следующей анкеты: {e}")
+            match_card = None
+        if match_card and eligibility.is_eligible(user_id, match_card[0], search_gender):
+            return match_card
+    elif entry:
+        entry[1].cancel()
+
+    return await prepare_match_card(user_id, search_gender)
 
 async def find_match(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -1056,17 +1013,12 @@ async def find_match(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     context.user_data.pop('current_match_id', None)
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT user_id, is_approved FROM users WHERE user_id = ?", (user_id,))
-    user = cursor.fetchone()
+    user = await db.get_user_approval(user_id)
 
     if not user:
         keyboard = [[InlineKeyboardButton("📝 Создать анкету", callback_data="create_profile")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         await query.edit_message_text("Сначала создай анкету!", reply_markup=reply_markup)
-        conn.close()
         return
 
     is_approved = user[1]
@@ -1078,66 +1030,26 @@ async def find_match(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "Пожалуйста, подожди, пока мы ее проверим! ⏳",
             reply_markup=reply_markup
         )
-        conn.close()
         return
 
-    cursor.execute("SELECT search_gender, gender FROM users WHERE user_id = ?", (user_id,))
-    user_settings = cursor.fetchone()
+    user_settings = await db.get_search_settings(user_id)
 
     if not user_settings:
         keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]]
         reply_markup = InlineKeyboardMarkup(keyboard)
         await query.edit_message_text("Ошибка при получении настроек поиска.", reply_markup=reply_markup)
-        conn.close()
         return
 
     search_gender = user_settings[0] or 'все'
-    user_gender = user_settings[1]
-
-    if search_gender == "парни":
-        gender_condition = "u.gender = 'мужской'"
-    elif search_gender == "девушки":
-        gender_condition = "u.gender = 'женский'"
-    else:
-        gender_condition = "1=1"
-
-    cursor.execute('SELECT to_user_id FROM likes WHERE from_user_id = ?', (user_id,))
-    liked_users = [row[0] for row in cursor.fetchall()]
-
-    params = [user_id]
-
-    sql_query = f'''
-        SELECT u.user_id, u.username, u.first_name, u.last_name, u.class, 
-               u.interests, u.about_me, u.gender, u.photo_path,
-               u.favorite_subject, u.hobby, u.dream
-        FROM users u
-        WHERE u.user_id != ? 
-        AND u.is_active = 1
-        AND u.is_approved = 1
-        AND ({gender_condition})
-    '''
-
-    if liked_users:
-        placeholders = ','.join(['?' for _ in liked_users])
-        sql_query += f" AND u.user_id NOT IN ({placeholders})"
-        params.extend(liked_users)
-
-    sql_query += " ORDER BY RANDOM() LIMIT 1"
 
     try:
-        cursor.execute(sql_query, params)
+        match_card = await take_match_card(user_id, search_gender)
     except Exception as e:
         logger.error(f"Ошибка SQL запроса: {e}")
-        logger.error(f"SQL: {sql_query}")
-        logger.error(f"Параметры: {params}")
-        conn.close()
         await query.edit_message_text("Произошла ошибка при поиске. Попробуйте позже.")
         return
 
-    match_user = cursor.fetchone()
-    conn.close()
-
-    if not match_user:
+    if not match_card:
         keyboard = [
             [InlineKeyboardButton("🔄 Попробовать снова", callback_data="find_match")],
             [InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]
@@ -1150,18 +1062,10 @@ async def find_match(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    context.user_data['current_match_id'] = match_user[0]
-
-    profile_text = (
-        f"👤 {match_user[2]} {match_user[3] or ''}\n"
-        f"🏫 Класс: {match_user[4]}\n"
-        f"⚧ Пол: {match_user[7]}\n"
-        f"🎯 Интересы: {match_user[5]}\n"
-        f"📚 Любимый предмет: {match_user[9] or 'Не указано'}\n"
-        f"🎨 Хобби: {match_user[10] or 'Не указано'}\n"
-        f"💫 Мечта: {match_user[11] or 'Не указано'}\n"
-        f"📝 О себе: {match_user[6]}\n"
-    )
+    match_user_id, profile_text, photo = match_card
+    context.user_data['current_match_id'] = match_user_id
+    seen.mark(user_id, match_user_id)
+    prefetch_match_card(user_id, search_gender)
 
     keyboard = [
         [
@@ -1175,40 +1079,38 @@ async def find_match(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    has_photo = match_user[8] and os.path.exists(match_user[8])
-
     try:
-        if has_photo:
-            with open(match_user[8], 'rb') as photo:
-                try:
-                    await query.edit_message_media(
-                        media=InputMediaPhoto(media=photo, caption=f"Вот анкета для знакомства:\n\n{profile_text}"),
-                        reply_markup=reply_markup
-                    )
-                except BadRequest:
-                    await query.message.reply_photo(
-                        photo=photo,
-                        caption=f"Вот анкета для знакомства:\n\n{profile_text}",
-                        reply_markup=reply_markup
-                    )
+        if photo:
+            try:
+                message = await query.edit_message_media(
+                    media=InputMediaPhoto(media=photo, caption=profile_text),
+                    reply_markup=reply_markup
+                )
+            except BadRequest:
+                message = await query.message.reply_photo(
+                    photo=photo,
+                    caption=profile_text,
+                    reply_markup=reply_markup
+                )
+            await cards.remember_photo(match_user_id, photo, message)
         else:
             await query.edit_message_text(
-                f"Вот анкета для знакомства:\n\n{profile_text}",
+                profile_text,
                 reply_markup=reply_markup
             )
 
     except Exception as e:
         logger.error(f"Ошибка при отправке анкеты: {e}")
-        if has_photo:
-            with open(match_user[8], 'rb') as photo:
-                await query.message.reply_photo(
-                    photo=photo,
-                    caption=f"Вот анкета для знакомства:\n\n{profile_text}",
-                    reply_markup=reply_markup
-                )
+        if photo:
+            message = await query.message.reply_photo(
+                photo=photo,
+                caption=profile_text,
+                reply_markup=reply_markup
+            )
+            await cards.remember_photo(match_user_id, photo, message)
         else:
             await query.message.reply_text(
-                f"Вот анкета для знакомства:\n\n{profile_text}",
+                profile_text,
                 reply_markup=reply_markup
             )
 
@@ -1216,178 +1118,90 @@ async def next_match(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    try:
-        await query.edit_message_text("🔍 Ищем следующего собеседника...")
-    except BadRequest:
-        await query.message.reply_text("🔍 Ищем следующего собеседника...")
-
     await find_match(update, context)
 
-async def like_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def send_like_result(update: Update, context: ContextTypes.DEFAULT_TYPE, liked_user_id, back_button, notify_liked):
     query = update.callback_query
-    await query.answer()
-
     user_id = update.effective_user.id
-    liked_user_id = context.user_data.get('current_match_id')
 
-    if not liked_user_id:
+    try:
+        created, mutual_like = await likes.like(user_id, liked_user_id)
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении лайка: {e}")
         try:
-            await query.edit_message_text("Ошибка! Попробуй найти собеседника снова.")
+            await query.edit_message_text("😔 Произошла ошибка при отправке лайка.")
         except BadRequest:
-            await query.message.reply_text("Ошибка! Попробуй найти собеседника снова.")
+            await query.message.reply_text("😔 Произошла ошибка при отправке лайка.")
         return
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute('''
-            SELECT id FROM likes 
-            WHERE from_user_id = ? AND to_user_id = ?
-        ''', (user_id, liked_user_id))
-        existing_like = cursor.fetchone()
-
-        if existing_like:
-            keyboard = [
-                [InlineKeyboardButton("➡️ Смотреть дальше", callback_data="next_match")],
-                [InlineKeyboardButton("🔙 В главное меню", callback_data="main_menu")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            try:
-                await query.edit_message_text(
-                    "❌ Ты уже лайкал эту анкету ранее!",
-                    reply_markup=reply_markup
-                )
-            except BadRequest:
-                await query.message.reply_text(
-                    "❌ Ты уже лайкал эту анкету ранее!",
-                    reply_markup=reply_markup
-                )
-            conn.close()
-            return
-
-        cursor.execute('''
-            INSERT INTO likes (from_user_id, to_user_id, liked_at)
-            VALUES (?, ?, ?)
-        ''', (user_id, liked_user_id, datetime.now()))
-
-        cursor.execute("SELECT first_name, last_name FROM users WHERE user_id = ?", (user_id,))
-        liker_user = cursor.fetchone()
-
-        if liker_user:
-            notification_text = (
-                f"💖 Твоя анкета кому-то понравилась!\n\n"
-                f"Кто-то поставил лайк твоей анкете. "
-                f"Если поставишь взаимный лайк - узнаешь кто это! 😊"
-            )
-
-            keyboard = [
-                [InlineKeyboardButton("👀 Посмотреть анкету", callback_data=f"view_anonymous_{user_id}")],
-                [InlineKeyboardButton("💝 Мои лайки", callback_data="my_likes")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            try:
-                await context.bot.send_message(
-                    chat_id=liked_user_id,
-                    text=notification_text,
-                    reply_markup=reply_markup
-                )
-            except Exception as e:
-                logger.error(f"Ошибка при отправке уведомления пользователю {liked_user_id}: {e}")
-
-        cursor.execute('''
-            SELECT id FROM likes 
-            WHERE from_user_id = ? AND to_user_id = ?
-        ''', (liked_user_id, user_id))
-        mutual_like = cursor.fetchone()
-
-        if mutual_like:
-            cursor.execute('''
-                INSERT INTO matches (user1_id, user2_id, matched_at)
-                VALUES (?, ?, ?)
-            ''', (min(user_id, liked_user_id), max(user_id, liked_user_id), datetime.now()))
+    if not created:
+        text = "❌ Ты уже лайкал эту анкету ранее!"
+        keyboard = [back_button, [InlineKeyboardButton("🔙 В главное меню", callback_data="main_menu")]]
+    elif not mutual_like:
+        text = (
+            "💖 Твой лайк отправлен!\n"
+            "Если этот пользователь тоже лайкнет тебя - вы получите уведомление о совпадении!"
+        )
+        keyboard = [back_button, [InlineKeyboardButton("🔙 В главное меню", callback_data="main_menu")]]
 
-            cursor.execute("SELECT username, first_name, last_name FROM users WHERE user_id = ?", (liked_user_id,))
-            matched_user = cursor.fetchone()
+    if created and notify_liked and not mutual_like:
+        like_notifier.add(liked_user_id, user_id)
 
-            conn.commit()
+    if mutual_like:
+        like_notifier.discard(user_id, liked_user_id)
+        contacts = await db.get_user_contacts(user_id, liked_user_id)
+        matched_user = contacts.get(liked_user_id, ('', '', ''))
+        current_user = contacts.get(user_id, ('', '', ''))
 
-            keyboard = [
-                [InlineKeyboardButton("👀 Посмотреть анкету", callback_data=f"view_match_{liked_user_id}")],
-                [InlineKeyboardButton("💝 Мои совпадения", callback_data="my_matches")],
-                [InlineKeyboardButton("🔙 В главное меню", callback_data="main_menu")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            try:
-                await query.edit_message_text(
-                    f"🎉 У вас взаимная симпатия с {matched_user[1]} {matched_user[2] or ''} (@{matched_user[0] or 'без username'})!\n\n"
-                    "Теперь вы можете написать друг другу!",
-                    reply_markup=reply_markup
-                )
-            except BadRequest:
-                await query.message.reply_text(
-                    f"🎉 У вас взаимная симпатия с {matched_user[1]} {matched_user[2] or ''} (@{matched_user[0] or 'без username'})!\n\n"
-                    "Теперь вы можете написать друг другу!",
-                    reply_markup=reply_markup
-                )
-
-            cursor.execute("SELECT first_name, last_name, username FROM users WHERE user_id = ?", (user_id,))
-            current_user = cursor.fetchone()
+        text = (
+            f"🎉 У вас взаимная симпатия с {matched_user[1]} {matched_user[2] or ''} (@{matched_user[0] or 'без username'})!\n\n"
+            "Теперь вы можете написать друг другу!"
+        )
+        keyboard = [
+            [InlineKeyboardButton("👀 Посмотреть анкету", callback_data=f"view_match_{liked_user_id}")],
+            [InlineKeyboardButton("💝 Мои совпадения", callback_data="my_matches")],
+            [InlineKeyboardButton("🔙 В главное меню", callback_data="main_menu")]
+        ]
 
-            mutual_notification = (
-                f"🎉 У вас взаимная симпатия с {current_user[0]} {current_user[1] or ''} "
-                f"(@{current_user[2] or 'без username'})!\n\n"
-                "Теперь вы можете написать друг другу!"
+        mutual_keyboard = [
+            [InlineKeyboardButton("👀 Посмотреть анкету", callback_data=f"view_match_{user_id}")],
+            [InlineKeyboardButton("💝 Мои совпадения", callback_data="my_matches")]
+        ]
+        try:
+            await outbox.send(
+                liked_user_id,
+                f"🎉 У вас взаимная симпатия с {current_user[1]} {current_user[2] or ''} "
+                f"(@{current_user[0] or 'без username'})!\n\n"
+                "Теперь вы можете написать друг другу!",
+                reply_markup=InlineKeyboardMarkup(mutual_keyboard)
             )
+        except Exception as e:
+            logger.error(f"Ошибка при отправке уведомления о взаимном лайке: {e}")
 
-            mutual_keyboard = [
-                [InlineKeyboardButton("👀 Посмотреть анкету", callback_data=f"view_match_{user_id}")],
-                [InlineKeyboardButton("💝 Мои совпадения", callback_data="my_matches")]
-            ]
-            mutual_reply_markup = InlineKeyboardMarkup(mutual_keyboard)
-
-            try:
-                await context.bot.send_message(
-                    chat_id=liked_user_id,
-                    text=mutual_notification,
-                    reply_markup=mutual_reply_markup
-                )
-            except Exception as e:
-                logger.error(f"Ошибка при отправке уведомления о взаимном лайке: {e}")
-
-        else:
-            conn.commit()
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    try:
+        await query.edit_message_text(text, reply_markup=reply_markup)
+    except BadRequest:
+        await query.message.reply_text(text, reply_markup=reply_markup)
 
-            keyboard = [
-                [InlineKeyboardButton("➡️ Смотреть дальше", callback_data="next_match")],
-                [InlineKeyboardButton("🔙 В главное меню", callback_data="main_menu")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
+async def like_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
 
-            try:
-                await query.edit_message_text(
-                    "💖 Твой лайк отправлен!\n"
-                    "Если этот пользователь тоже лайкнет тебя - вы получите уведомление о совпадении!",
-                    reply_markup=reply_markup
-                )
-            except BadRequest:
-                await query.message.reply_text(
-                    "💖 Твой лайк отправлен!\n"
-                    "Если этот пользователь тоже лайкнет тебя - вы получите уведомление о совпадении!",
-                    reply_markup=reply_markup
-                )
+    liked_user_id = context.user_data.get('current_match_id')
 
-    except Exception as e:
-        logger.error(f"Ошибка при сохранении лайка: {e}")
+    if not liked_user_id:
         try:
-            await query.edit_message_text("😔 Произошла ошибка при отправке лайка.")
+            await query.edit_message_text("Ошибка! Попробуй найти собеседника снова.")
         except BadRequest:
-            await query.message.reply_text("😔 Произошла ошибка при отправке лайка.")
+            await query.message.reply_text("Ошибка! Попробуй найти собеседника снова.")
+        return
 
-    finally:
-        conn.close()
+    await send_like_result(
+        update, context, liked_user_id,
+        [InlineKeyboardButton("➡️ Смотреть дальше", callback_data="next_match")],
+        notify_liked=True
+    )
 
 async def view_anonymous_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -1399,30 +1213,13 @@ async def view_anonymous_profile(update: Update, context: ContextTypes.DEFAULT_T
         await query.answer("Ошибка: неверный ID пользователя")
         return
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT first_name, last_name, class, interests, about_me, gender, photo_path, favorite_subject, hobby, dream FROM users WHERE user_id = ?",
-        (anonymous_user_id,)
-    )
-    user = cursor.fetchone()
-    conn.close()
+    card = await cards.get(anonymous_user_id, 'anonymous')
 
-    if not user:
+    if not card:
         await query.answer("Анкета не найдена!")
         return
 
-    profile_text = (
-        f"👤 Анонимная анкета:\n\n"
-        f"🏫 Класс: {user[2]}\n"
-        f"⚧ Пол: {user[5]}\n"
-        f"🎯 Интересы: {user[3]}\n"
-        f"📚 Любимый предмет: {user[7] or 'Не указано'}\n"
-        f"🎨 Хобби: {user[8] or 'Не указано'}\n"
-        f"💫 Мечта: {user[9] or 'Не указано'}\n"
-        f"📝 О себе: {user[4]}\n\n"
-        f"💖 Поставь лайк этой анкете, и если это взаимно - узнаешь кто это!"
-    )
+    profile_text = card.text
 
     keyboard = [
         [InlineKeyboardButton("💖 Лайкнуть эту анкету", callback_data=f"like_anonymous_{anonymous_user_id}")],
@@ -1430,32 +1227,32 @@ async def view_anonymous_profile(update: Update, context: ContextTypes.DEFAULT_T
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    has_photo = user[6] and os.path.exists(user[6])
+    photo = await load_photo(card.photo_path, card.photo_file_id)
 
     try:
-        if has_photo:
-            with open(user[6], 'rb') as photo:
-                try:
-                    await query.edit_message_media(
-                        media=InputMediaPhoto(media=photo, caption=profile_text),
-                        reply_markup=reply_markup
-                    )
-                except BadRequest:
-                    await query.message.reply_photo(
-                        photo=photo,
-                        caption=profile_text,
-                        reply_markup=reply_markup
-                    )
-        else:
-            await query.edit_message_text(profile_text, reply_markup=reply_markup)
-    except BadRequest:
-        if has_photo:
-            with open(user[6], 'rb') as photo:
-                await query.message.reply_photo(
+        if photo:
+            try:
+                message = await query.edit_message_media(
+                    media=InputMediaPhoto(media=photo, caption=profile_text),
+                    reply_markup=reply_markup
+                )
+            except BadRequest:
+                message = await query.message.reply_photo(
                     photo=photo,
                     caption=profile_text,
                     reply_markup=reply_markup
                 )
+            await cards.remember_photo(anonymous_user_id, photo, message)
+        else:
+            await query.edit_message_text(profile_text, reply_markup=reply_markup)
+    except BadRequest:
+        if photo:
+            message = await query.message.reply_photo(
+                photo=photo,
+                caption=profile_text,
+                reply_markup=reply_markup
+            )
+            await cards.remember_photo(anonymous_user_id, photo, message)
         else:
             await query.message.reply_text(profile_text, reply_markup=reply_markup)
 
@@ -1463,186 +1260,23 @@ async def like_anonymous_user(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
     await query.answer()
 
-    user_id = update.effective_user.id
-
     try:
         anonymous_user_id = int(query.data.replace('like_anonymous_', ''))
     except ValueError:
         await query.answer("Ошибка: неверный ID пользователя")
         return
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
-
-    try:
-        cursor.execute('''
-            SELECT id FROM likes 
-            WHERE from_user_id = ? AND to_user_id = ?
-        ''', (user_id, anonymous_user_id))
-        existing_like = cursor.fetchone()
-
-        if existing_like:
-            keyboard = [
-                [InlineKeyboardButton("💝 Мои лайки", callback_data="my_likes")],
-                [InlineKeyboardButton("🔙 В главное меню", callback_data="main_menu")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            try:
-                await query.edit_message_text(
-                    "❌ Ты уже лайкал эту анкету ранее!",
-                    reply_markup=reply_markup
-                )
-            except BadRequest:
-                await query.message.reply_text(
-                    "❌ Ты уже лайкал эту анкету ранее!",
-                    reply_markup=reply_markup
-                )
-            return
-
-        cursor.execute('''
-            INSERT INTO likes (from_user_id, to_user_id, liked_at)
-            VALUES (?, ?, ?)
-        ''', (user_id, anonymous_user_id, datetime.now()))
-
-        cursor.execute('''
-            SELECT id FROM likes 
-            WHERE from_user_id = ? AND to_user_id = ?
-        ''', (anonymous_user_id, user_id))
-        mutual_like = cursor.fetchone()
-
-        if mutual_like:
-            cursor.execute('''
-                INSERT INTO matches (user1_id, user2_id, matched_at)
-                VALUES (?, ?, ?)
-            ''', (min(user_id, anonymous_user_id), max(user_id, anonymous_user_id), datetime.now()))
-
-            cursor.execute("SELECT username, first_name, last_name FROM users WHERE user_id = ?", (anonymous_user_id,))
-            matched_user = cursor.fetchone()
-
-            conn.commit()
-
-            keyboard = [
-                [InlineKeyboardButton("👀 Посмотреть анкету", callback_data=f"view_match_{anonymous_user_id}")],
-                [InlineKeyboardButton("💝 Мои совпадения", callback_data="my_matches")],
-                [InlineKeyboardButton("🔙 В главное меню", callback_data="main_menu")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            try:
-                await query.edit_message_text(
-                    f"🎉 У вас взаимная симпатия с {matched_user[1]} {matched_user[2] or ''} (@{matched_user[0] or 'без username'})!\n\n"
-                    "Теперь вы можете написать друг другу!",
-                    reply_markup=reply_markup
-                )
-            except BadRequest:
-                await query.message.reply_text(
-                    f"🎉 У вас взаимная симпатия с {matched_user[1]} {matched_user[2] or ''} (@{matched_user[0] or 'без username'})!\n\n"
-                    "Теперь вы можете написать друг другу!",
-                    reply_markup=reply_markup
-                )
-
-            cursor.execute("SELECT first_name, last_name, username FROM users WHERE user_id = ?", (user_id,))
-            current_user = cursor.fetchone()
-
-            mutual_notification = (
-                f"🎉 У вас взаимная симпатия с {current_user[0]} {current_user[1] or ''} "
-                f"(@{current_user[2] or 'без username'})!\n\n"
-                "Теперь вы можете написать друг другу!"
-            )
-
-            mutual_keyboard = [
-                [InlineKeyboardButton("👀 Посмотреть анкету", callback_data=f"view_match_{user_id}")],
-                [InlineKeyboardButton("💝 Мои совпадения", callback_data="my_matches")]
-            ]
-            mutual_reply_markup = InlineKeyboardMarkup(mutual_keyboard)
-
-            try:
-                await context.bot.send_message(
-                    chat_id=anonymous_user_id,
-                    text=mutual_notification,
-                    reply_markup=mutual_reply_markup
-                )
-            except Exception as e:
-                logger.error(f"Ошибка при отправке уведомления о взаимном лайке: {e}")
-
-        else:
-            conn.commit()
-
-            keyboard = [
-                [InlineKeyboardButton("💝 Мои лайки", callback_data="my_likes")],
-                [InlineKeyboardButton("🔙 В главное меню", callback_data="main_menu")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-
-            try:
-                await query.edit_message_text(
-                    "💖 Твой лайк отправлен!\n"
-                    "Если этот пользователь тоже лайкнет тебя - вы получите уведомление о совпадении!",
-                    reply_markup=reply_markup
-                )
-            except BadRequest:
-                await query.message.reply_text(
-                    "💖 Твой лайк отправлен!\n"
-                    "Если этот пользователь тоже лайкнет тебя - вы получите уведомление о совпадении!",
-                    reply_markup=reply_markup
-                )
-
-    except Exception as e:
-        logger.error(f"Ошибка при сохранении лайка: {e}")
-        try:
-            await query.edit_message_text("😔 Произошла ошибка при отправке лайка.")
-        except BadRequest:
-            await query.message.reply_text("😔 Произошла ошибка при отправке лайка.")
-    finally:
-        conn.close()
+    await send_like_result(
+        update, context, anonymous_user_id,
+        [InlineKeyboardButton("💝 Мои лайки", callback_data="my_likes")],
+        notify_liked=False
+    )
 
 async def my_matches(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
-    user_id = update.effective_user.id
-
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        SELECT u.user_id, u.username, u.first_name, u.last_name, u.class, m.matched_at
-        FROM matches m
-        JOIN users u ON (u.user_id = m.user1_id OR u.user_id = m.user2_id) AND u.user_id != ?
-        WHERE (m.user1_id = ? OR m.user2_id = ?) AND m.status = 'active'
-        ORDER BY m.matched_at DESC
-    ''', (user_id, user_id, user_id))
-
-    matches = cursor.fetchall()
-    conn.close()
-
-    if not matches:
-        keyboard = [
-            [InlineKeyboardButton("👀 Найти собеседника", callback_data="find_match")],
-            [InlineKeyboardButton("🔙 Назад", callback_data="main_menu")]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        await query.edit_message_text(
-            "😔 У тебя пока нет совпадений.\n"
-            "Продолжай ставить лайки и скоро найдутся взаимные симпатии!",
-            reply_markup=reply_markup
-        )
-        return
-
-    matches_text = "💝 Твои совпадения:\n\n"
-    keyboard = []
-
-    for match in matches:
-        matches_text += f"👤 {match[2]} {match[3] or ''} (@{match[1] or 'без username'})\n🏫 {match[4]}\n\n"
-        keyboard.append([InlineKeyboardButton(
-            f"👤 {match[2]}",
-            callback_data=f"view_match_{match[0]}"
-        )])
-
-    keyboard.append([InlineKeyboardButton("🔙 Назад", callback_data="main_menu")])
-    reply_markup = InlineKeyboardMarkup(keyboard)
-
-    await query.edit_message_text(matches_text, reply_markup=reply_markup)
+    await show_page(update, context, 'matches')
 
 async def view_match(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
@@ -1654,43 +1288,26 @@ async def view_match(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.answer("Ошибка: неверный ID пользователя")
         return
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT username, first_name, last_name, class, interests, about_me, gender, photo_path, favorite_subject, hobby, dream FROM users WHERE user_id = ?",
-        (match_user_id,)
-    )
-    user = cursor.fetchone()
-    conn.close()
+    card = await cards.get(match_user_id, 'match')
 
-    if not user:
+    if not card:
         await query.answer("Пользователь не найден!")
         return
 
-    profile_text = (
-        f"👤 {user[1]} {user[2] or ''}\n"
-        f"📱 @{user[0] or 'без username'}\n"
-        f"🏫 Класс: {user[3]}\n"
-        f"⚧ Пол: {user[6]}\n"
-        f"🎯 Интересы: {user[4]}\n"
-        f"📚 Любимый предмет: {user[8] or 'Не указано'}\n"
-        f"🎨 Хобби: {user[9] or 'Не указано'}\n"
-        f"💫 Мечта: {user[10] or 'Не указано'}\n"
-        f"📝 О себе: {user[5]}\n"
-    )
+    profile_text = card.text
 
     keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="my_matches")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    has_photo = user[7] and os.path.exists(user[7])
+    photo = await load_photo(card.photo_path, card.photo_file_id)
 
-    if has_photo:
-        with open(user[7], 'rb') as photo:
-            await query.message.reply_photo(
-                photo=photo,
-                caption=profile_text,
-                reply_markup=reply_markup
-            )
+    if photo:
+        message = await query.message.reply_photo(
+            photo=photo,
+            caption=profile_text,
+            reply_markup=reply_markup
+        )
+        await cards.remember_photo(match_user_id, photo, message)
         await query.delete_message()
     else:
         try:
@@ -1792,29 +1409,14 @@ async def handle_user_report(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await update.message.reply_text("Ошибка: пользователь не найден.")
             return
 
-        conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-        cursor = conn.cursor()
-
-        cursor.execute("SELECT user_id FROM users WHERE user_id = ?", (reported_user_id,))
-        user_exists = cursor.fetchone()
-
-        if not user_exists:
-            conn.close()
+        if not await db.user_exists(reported_user_id):
             await update.message.reply_text(
                 "Пользователь с таким ID не найден в системе."
             )
             context.user_data.clear()
             return
 
-        cursor.execute('''
-            SELECT id FROM reports 
-            WHERE reporter_id = ? AND reported_user_id = ? AND status = 'pending'
-        ''', (user_id, reported_user_id))
-
-        existing_report = cursor.fetchone()
-
-        if existing_report:
-            conn.close()
+        if await db.has_pending_report(user_id, reported_user_id):
             await update.message.reply_text(
                 "Вы уже отправляли жалобу на этого пользователя. "
                 "Дождитесь ее рассмотрения модераторами."
@@ -1823,42 +1425,14 @@ async def handle_user_report(update: Update, context: ContextTypes.DEFAULT_TYPE)
             return
 
         try:
-            cursor.execute('''
-                INSERT INTO reports (reporter_id, reported_user_id, reason, reported_at, status)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (user_id, reported_user_id, reason, datetime.now(), 'pending'))
+            await db.add_report(user_id, reported_user_id, reason)
 
-            conn.commit()
-
-            cursor.execute('''
-                UPDATE users 
-                SET reported_count = reported_count + 1, last_reported = ?
-                WHERE user_id = ?
-            ''', (datetime.now(), reported_user_id))
-
-            conn.commit()
-
-            cursor.execute("SELECT first_name, last_name, class FROM users WHERE user_id = ?", (reported_user_id,))
-            reported_user = cursor.fetchone()
+            reported_user = await db.get_user_brief(reported_user_id)
 
             reported_name = f"{reported_user[0]} {reported_user[1] or ''}" if reported_user else f"Пользователь {reported_user_id}"
             reported_class = reported_user[2] if reported_user else "неизвестно"
 
-            for admin_id in ADMIN_IDS:
-                try:
-                    await context.bot.send_message(
-                        chat_id=admin_id,
-                        text=f"🚨 Новая жалоба!\n\n"
-                             f"👤 На пользователя: {reported_name}\n"
-                             f"🏫 Класс: {reported_class}\n"
-                             f"🆔 ID: {reported_user_id}\n"
-                             f"📝 Причина: {reason}\n\n"
-                             f"Используйте панель модерации для проверки."
-                    )
-                except Exception as e:
-                    logger.error(f"Ошибка при отправке уведомления администратору {admin_id}: {e}")
-
-            conn.close()
+            admin_digest.add_report(reported_user_id, f"{reported_name.strip()} ({reported_class})", reason)
 
             context.user_data.pop('awaiting_report_reason', None)
             context.user_data.pop('report_target_id', None)
@@ -1875,7 +1449,6 @@ async def handle_user_report(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
         except Exception as e:
             logger.error(f"Ошибка при сохранении жалобы: {e}")
-            conn.close()
             await update.message.reply_text(
                 "😔 Произошла ошибка при отправке жалобы. Попробуйте позже."
             )
@@ -1887,36 +1460,23 @@ async def debug_moderation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(user_id):
         return
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
-
-    cursor.execute("PRAGMA table_info(users)")
-    columns = cursor.fetchall()
-    columns_info = "Структура таблицы users:\n"
+    columns = await db.get_users_columns()
+    columns_info = f"Версия схемы: {await db.get_schema_version()}\n\n"
+    columns_info += "Структура таблицы users:\n"
     for col in columns:
         columns_info += f"• {col[1]} ({col[2]})\n"
 
-    cursor.execute(
-        "SELECT user_id, is_under_review, is_approved, first_name, class FROM users WHERE is_under_review = 1")
-    pending_profiles = cursor.fetchall()
+    pending_profiles, total_users, recent_profiles = await db.get_moderation_debug()
 
     pending_info = f"\nАнкеты на модерации (is_under_review=1): {len(pending_profiles)}\n"
     for profile in pending_profiles:
         pending_info += f"• ID: {profile[0]}, Имя: {profile[3]}, Класс: {profile[4]}, review: {profile[1]}, approved: {profile[2]}\n"
 
-    cursor.execute("SELECT COUNT(*) FROM users")
-    total_users = cursor.fetchone()[0]
-
-    cursor.execute(
-        "SELECT user_id, is_under_review, is_approved, is_active, first_name FROM users ORDER BY user_id DESC LIMIT 10")
-    recent_profiles = cursor.fetchall()
-
     recent_info = f"\nПоследние 10 анкет (всего: {total_users}):\n"
     for profile in recent_profiles:
         recent_info += f"• ID: {profile[0]}, Имя: {profile[4]}, review: {profile[1]}, approved: {profile[2]}, active: {profile[3]}\n"
 
     debug_text = columns_info + pending_info + recent_info
-    conn.close()
 
     keyboard = [
         [InlineKeyboardButton("🔧 Исправить проблемы", callback_data="fix_moderation")],
@@ -1937,39 +1497,18 @@ async def fix_moderation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(user_id):
         return
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
-
-    cursor.execute("PRAGMA table_info(users)")
-    columns = [col[1] for col in cursor.fetchall()]
+    fixed_count, pending_count, wrong_state = await db.fix_moderation_flags()
 
     fix_log = "Исправление проблем с модерацией:\n\n"
 
-    if 'is_under_review' not in columns:
-        fix_log += "❌ Колонка is_under_review отсутствует!\n"
-        cursor.execute("ALTER TABLE users ADD COLUMN is_under_review BOOLEAN DEFAULT FALSE")
-        fix_log += "✅ Колонка is_under_review добавлена\n"
-
-    cursor.execute(
-        "UPDATE users SET is_under_review = 1 WHERE is_approved = 0 AND (is_under_review = 0 OR is_under_review IS NULL)")
-    fixed_count = cursor.rowcount
     fix_log += f"✅ Обновлено {fixed_count} анкет с is_under_review = 1\n"
 
-    cursor.execute("SELECT COUNT(*) FROM users WHERE is_under_review = 1")
-    pending_count = cursor.fetchone()[0]
-
-    cursor.execute("SELECT COUNT(*) FROM users WHERE is_approved = 1 AND is_under_review = 1")
-    wrong_state = cursor.fetchone()[0]
     if wrong_state > 0:
-        cursor.execute("UPDATE users SET is_under_review = 0 WHERE is_approved = 1 AND is_under_review = 1")
         fix_log += f"✅ Исправлено {wrong_state} одобренных анкет с is_under_review = 1\n"
 
     fix_log += f"\nТекущее состояние:\n"
     fix_log += f"• Анкет на модерации: {pending_count}\n"
 
-    conn.commit()
-    conn.close()
-
     keyboard = [
         [InlineKeyboardButton("🔄 Проверить снова", callback_data="debug_moderation")],
         [InlineKeyboardButton("📋 Анкеты на модерации", callback_data="review_profiles")],
@@ -1994,58 +1533,26 @@ async def moderation_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("У вас нет прав для этого действия!")
         return
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
-
     try:
-        cursor.execute("PRAGMA table_info(users)")
-        columns = [col[1] for col in cursor.fetchall()]
-
-        if 'is_under_review' not in columns:
-            stats_text = (
-                "🛠️ Панель модерации\n\n"
-                "⚠️ Внимание: обнаружены проблемы с базой данных!\n"
-                "Колонка is_under_review отсутствует.\n\n"
-                "Нажмите 'Исправить проблемы' для автоматического исправления."
-            )
+        pending_count, reports_count, approved_users, banned_users = await db.get_moderation_counts()
 
-            keyboard = [
-                [InlineKeyboardButton("🔧 Исправить проблемы", callback_data="fix_moderation")],
-                [InlineKeyboardButton("🔍 Отладка", callback_data="debug_moderation")],
-                [InlineKeyboardButton("📋 Анкеты на модерации", callback_data="review_profiles")],
-                [InlineKeyboardButton("🚨 Жалобы", callback_data="review_reports")],
-                [InlineKeyboardButton("📊 Статистика", callback_data="moderation_stats")],
-                [InlineKeyboardButton("🔙 В главное меню", callback_data="main_menu")]
-            ]
-        else:
-            cursor.execute("SELECT COUNT(*) FROM users WHERE is_under_review = 1")
-            pending_count = cursor.fetchone()[0]
-
-            cursor.execute("SELECT COUNT(*) FROM reports WHERE status = 'pending'")
-            reports_count = cursor.fetchone()[0]
-
-            cursor.execute("SELECT COUNT(*) FROM users WHERE is_approved = 1")
-            approved_users = cursor.fetchone()[0]
-
-            cursor.execute("SELECT COUNT(*) FROM users WHERE is_active = 0")
-            banned_users = cursor.fetchone()[0]
-
-            stats_text = (
-                "🛠️ Панель модерации\n\n"
-                f"📊 Статистика:\n"
-                f"• Анкеты на модерации: {pending_count}\n"
-                f"• Жалобы на рассмотрении: {reports_count}\n"
-                f"• Одобренных пользователей: {approved_users}\n"
-                f"• Заблокированных пользователей: {banned_users}\n"
-            )
+        stats_text = (
+            "🛠️ Панель модерации\n\n"
+            f"📊 Статистика:\n"
+            f"• Анкеты на модерации: {pending_count}\n"
+            f"• Жалобы на рассмотрении: {reports_count}\n"
+            f"• Одобренных пользователей: {approved_users}\n"
+            f"• Заблокированных пользователей: {banned_users}\n"
+        )
 
-            keyboard = [
-                [InlineKeyboardButton("📋 Анкеты на модерации", callback_data="review_profiles")],
-                [InlineKeyboardButton("🚨 Жалобы", callback_data="review_reports")],
-                [InlineKeyboardButton("📊 Статистика", callback_data="moderation_stats")],
-                [InlineKeyboardButton("🔍 Отладка", callback_data="debug_moderation")],
-                [InlineKeyboardButton("🔙 В главное меню", callback_data="main_menu")]
-            ]
+        keyboard = [
+            [InlineKeyboardButton("📋 Анкеты на модерации", callback_data="review_profiles")],
+            [InlineKeyboardButton("🚨 Жалобы", callback_data="review_reports")],
+            [InlineKeyboardButton("📊 Статистика", callback_data="moderation_stats")],
+            [InlineKeyboardButton("📣 Рассылка", callback_data="broadcast_menu")],
+            [InlineKeyboardButton("🔍 Отладка", callback_data="debug_moderation")],
+            [InlineKeyboardButton("🔙 В главное меню", callback_data="main_menu")]
+        ]
     except Exception as e:
         logger.error(f"Ошибка при получении статистики: {e}")
         stats_text = "🛠️ Панель модерации\n\n⚠️ Ошибка при получении данных."
@@ -2056,8 +1563,6 @@ async def moderation_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
             [InlineKeyboardButton("🔙 В главное меню", callback_data="main_menu")]
         ]
 
-    conn.close()
-
     reply_markup = InlineKeyboardMarkup(keyboard)
 
     if query:
@@ -2068,6 +1573,28 @@ async def moderation_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await update.message.reply_text(stats_text, reply_markup=reply_markup)
 
+async def similar_photo_warnings(user_id, photo_hash):
+    if not photo_hash:
+        return ""
+
+    distances = dict(photo_index.similar(photo_hash))
+    if not distances:
+        return ""
+
+    owners = await db.get_photo_owners(list(distances), user_id)
+    owners.sort(key=lambda owner: distances[owner[5]])
+
+    lines = []
+    for owner_id, first_name, last_name, is_active, is_approved, _ in owners[:SIMILAR_PHOTOS_SHOWN]:
+        if not is_active:
+            status = "заблокирован"
+        elif is_approved:
+            status = "активен"
+        else:
+            status = "на модерации"
+        lines.append(f"⚠️ Похожее фото использует {first_name} {last_name or ''} (ID {owner_id}, {status})")
+    return "\n\n" + "\n".join(lines) if lines else ""
+
 async def review_profiles(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -2077,45 +1604,14 @@ async def review_profiles(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.answer("У вас нет прав для этого действия!")
         return
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
-
     try:
-        cursor.execute("PRAGMA table_info(users)")
-        columns = [col[1] for col in cursor.fetchall()]
-
-        if 'is_under_review' not in columns:
-            conn.close()
-            keyboard = [
-                [InlineKeyboardButton("🔧 Исправить проблемы", callback_data="fix_moderation")],
-                [InlineKeyboardButton("🔙 Назад", callback_data="moderation_panel")]
-            ]
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            await query.edit_message_text(
-                "❌ Ошибка: колонка is_under_review отсутствует в базе данных!\n\n"
-                "Нажмите кнопку ниже для автоматического исправления.",
-                reply_markup=reply_markup
-            )
-            return
-
-        cursor.execute('''
-            SELECT user_id, username, first_name, last_name, class, 
-                   interests, about_me, gender, favorite_subject, hobby, dream,
-                   registered_at, photo_path, is_under_review
-            FROM users 
-            WHERE is_under_review = 1 
-            ORDER BY registered_at ASC 
-            LIMIT 1
-        ''')
-
-        profile = cursor.fetchone()
+        profile = await db.get_next_profile_for_review()
+        card = await cards.get(profile[0], 'moderation') if profile else None
     except Exception as e:
         logger.error(f"Ошибка при получении анкет на модерации: {e}")
-        profile = None
-
-    conn.close()
+        card = None
 
-    if not profile:
+    if not card:
         keyboard = [
             [InlineKeyboardButton("🔍 Отладка", callback_data="debug_moderation")],
             [InlineKeyboardButton("🔙 Назад", callback_data="moderation_panel")]
@@ -2129,22 +1625,9 @@ async def review_profiles(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    context.user_data['current_moderation_id'] = profile[0]
-
-    profile_text = (
-        f"📋 Анкета на модерации:\n\n"
-        f"👤 Пользователь: {profile[2]} {profile[3] or ''}\n"
-        f"📱 @{profile[1] or 'без username'}\n"
-        f"🏫 Класс: {profile[4]}\n"
-        f"⚧ Пол: {profile[7]}\n"
-        f"🎯 Интересы: {profile[5]}\n"
-        f"📚 Любимый предмет: {profile[8] or 'Не указано'}\n"
-        f"🎨 Хобби: {profile[9] or 'Не указано'}\n"
-        f"💫 Мечта: {profile[10] or 'Не указано'}\n"
-        f"📝 О себе: {profile[6]}\n"
-        f"📅 Дата регистрации: {profile[11]}\n"
-        f"🆔 ID: {profile[0]}"
-    )
+    context.user_data['current_moderation_id'] = card.user_id
+
+    profile_text = card.text + await similar_photo_warnings(card.user_id, card.photo_hash)
 
     keyboard = [
         [
@@ -2159,15 +1642,15 @@ async def review_profiles(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
-    has_photo = profile[12] and os.path.exists(profile[12])
+    photo = await load_photo(card.photo_path, card.photo_file_id)
 
-    if has_photo:
-        with open(profile[12], 'rb') as photo:
-            await query.message.reply_photo(
-                photo=photo,
-                caption=profile_text,
-                reply_markup=reply_markup
-            )
+    if photo:
+        message = await query.message.reply_photo(
+            photo=photo,
+            caption=profile_text,
+            reply_markup=reply_markup
+        )
+        await cards.remember_photo(card.user_id, photo, message)
         await query.delete_message()
     else:
         await query.edit_message_text(profile_text, reply_markup=reply_markup)
@@ -2186,25 +1669,17 @@ async def approve_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.edit_message_text("Ошибка: анкета не найдена.")
         return
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
-
     try:
-        cursor.execute("UPDATE users SET is_approved = 1, is_under_review = 0 WHERE user_id = ?", (target_user_id,))
-
-        cursor.execute('''
-            INSERT INTO admin_actions (admin_id, action, target_user_id, details, action_at)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, 'approve', target_user_id, 'Анкета одобрена', datetime.now()))
-
-        conn.commit()
+        await db.approve_profile(user_id, target_user_id)
+        eligibility.update_user(target_user_id, is_approved=True)
+        await ranking.refresh(db, target_user_id)
 
         try:
-            await context.bot.send_message(
-                chat_id=target_user_id,
-                text="🎉 Твоя анкета одобрена модераторами!\n\n"
-                     "Теперь ты можешь пользоваться ботом полностью!\n"
-                     "Используй команду /start для начала работы."
+            await outbox.send(
+                target_user_id,
+                "🎉 Твоя анкета одобрена модераторами!\n\n"
+                "Теперь ты можешь пользоваться ботом полностью!\n"
+                "Используй команду /start для начала работы."
             )
         except Exception as e:
             logger.error(f"Ошибка при отправке уведомления пользователю {target_user_id}: {e}")
@@ -2218,9 +1693,6 @@ async def approve_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.answer("❌ Ошибка при одобрении анкеты!")
         await query.edit_message_text("Произошла ошибка при одобрении анкеты.")
 
-    finally:
-        conn.close()
-
 async def reject_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -2262,29 +1734,21 @@ async def handle_moderation_reason(update: Update, context: ContextTypes.DEFAULT
         await update.message.reply_text("Ошибка обработки.")
         return
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
-
     try:
         action_type = 'reject' if context.user_data.get('awaiting_reject_reason') else 'ban'
+        action_text = "отклонена" if action_type == 'reject' else "заблокирована"
 
+        photo = await db.get_user_photo(target_user_id) if action_type == 'reject' else None
+        await db.moderate_profile(user_id, target_user_id, action_type, reason)
         if action_type == 'reject':
-            cursor.execute("DELETE FROM users WHERE user_id = ?", (target_user_id,))
-            cursor.execute("DELETE FROM likes WHERE from_user_id = ? OR to_user_id = ?",
-                           (target_user_id, target_user_id))
-            cursor.execute("DELETE FROM matches WHERE user1_id = ? OR user2_id = ?", (target_user_id, target_user_id))
-            action_text = "отклонена"
+            await forget_profile(target_user_id, photo)
+            context.application.drop_user_data(target_user_id)
         else:
-            cursor.execute("UPDATE users SET is_active = 0, is_approved = 0, is_under_review = 0 WHERE user_id = ?",
-                           (target_user_id,))
-            action_text = "заблокирована"
-
-        cursor.execute('''
-            INSERT INTO admin_actions (admin_id, action, target_user_id, details, action_at)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, action_type, target_user_id, f"Причина: {reason}", datetime.now()))
-
-        conn.commit()
+            ranking.remove_profile(target_user_id)
+            eligibility.update_user(target_user_id, is_active=False, is_approved=False)
+            candidates.reset(target_user_id)
+            drop_prefetched_card(target_user_id)
+            cards.bump(target_user_id)
 
         try:
             if action_type == 'reject':
@@ -2300,7 +1764,7 @@ async def handle_moderation_reason(update: Update, context: ContextTypes.DEFAULT
                     f"Для разблокировки обратись к администраторам."
                 )
 
-            await context.bot.send_message(chat_id=target_user_id, text=message_text)
+            await outbox.send(target_user_id, message_text)
         except Exception as e:
             logger.error(f"Ошибка при отправке уведомления: {e}")
 
@@ -2319,9 +1783,6 @@ async def handle_moderation_reason(update: Update, context: ContextTypes.DEFAULT
         logger.error(f"Ошибка при обработке модерации: {e}")
         await update.message.reply_text("❌ Ошибка при обработке!")
 
-    finally:
-        conn.close()
-
 async def skip_profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -2335,28 +1796,12 @@ async def review_reports(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(user_id):
         return
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
-
     try:
-        cursor.execute('''
-            SELECT r.id, r.reporter_id, r.reported_user_id, r.reason, r.reported_at, 
-                   u1.first_name as reporter_name, u2.first_name as reported_name
-            FROM reports r
-            LEFT JOIN users u1 ON r.reporter_id = u1.user_id
-            LEFT JOIN users u2 ON r.reported_user_id = u2.user_id
-            WHERE r.status = 'pending'
-            ORDER BY r.reported_at ASC
-            LIMIT 1
-        ''')
-
-        report = cursor.fetchone()
+        report = await db.get_next_report()
     except Exception as e:
         logger.error(f"Ошибка при получении жалоб: {e}")
         report = None
 
-    conn.close()
-
     if not report:
         await query.edit_message_text(
             "✅ Все жалобы обработаны!",
@@ -2399,29 +1844,8 @@ async def accept_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.answer("Ошибка: жалоба не найдена.")
         return
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
-
     try:
-        cursor.execute("UPDATE reports SET status = 'accepted', reviewed_by = ?, reviewed_at = ? WHERE id = ?",
-                       (user_id, datetime.now(), report_id))
-
-        cursor.execute('''
-            SELECT reported_user_id FROM reports WHERE id = ?
-        ''', (report_id,))
-
-        reported_user_id = cursor.fetchone()[0]
-
-        cursor.execute('''
-            UPDATE users SET reported_count = reported_count + 1, last_reported = ? WHERE user_id = ?
-        ''', (datetime.now(), reported_user_id))
-
-        cursor.execute('''
-            INSERT INTO admin_actions (admin_id, action, target_user_id, details, action_at)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, 'accept_report', reported_user_id, f'Жалоба #{report_id} принята', datetime.now()))
-
-        conn.commit()
+        await db.accept_report(user_id, report_id)
 
         await query.answer("✅ Жалоба принята!")
         await review_reports(update, context)
@@ -2430,9 +1854,6 @@ async def accept_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Ошибка при принятии жалобы: {e}")
         await query.answer("❌ Ошибка при обработке жалобы!")
 
-    finally:
-        conn.close()
-
 async def dismiss_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
@@ -2447,19 +1868,8 @@ async def dismiss_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await query.answer("Ошибка: жалоба не найдена.")
         return
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
-
     try:
-        cursor.execute("UPDATE reports SET status = 'dismissed', reviewed_by = ?, reviewed_at = ? WHERE id = ?",
-                       (user_id, datetime.now(), report_id))
-
-        cursor.execute('''
-            INSERT INTO admin_actions (admin_id, action, target_user_id, details, action_at)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user_id, 'dismiss_report', 0, f'Жалоба #{report_id} отклонена', datetime.now()))
-
-        conn.commit()
+        await db.dismiss_report(user_id, report_id)
 
         await query.answer("✅ Жалоба отклонена!")
         await review_reports(update, context)
@@ -2468,10 +1878,7 @@ async def dismiss_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Ошибка при отклонении жалобы: {e}")
         await query.answer("❌ Ошибка при обработке жалобы!")
 
-    finally:
-        conn.close()
-
-async def moderation_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def broadcast_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
 
@@ -2479,36 +1886,86 @@ async def moderation_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_admin(user_id):
         return
 
-    conn = sqlite3.connect('school_dating.db', check_same_thread=False)
-    cursor = conn.cursor()
+    context.user_data['awaiting_broadcast_text'] = True
+
+    await query.edit_message_text(
+        "📣 Отправьте текст рассылки одним сообщением.\n\n"
+        "Его получат все одобренные пользователи.",
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Отмена", callback_data="moderation_panel")]])
+    )
+
+async def handle_broadcast_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = update.effective_user.id
+    if not is_admin(user_id):
+        return
+
+    text = update.message.text
+    context.user_data.pop('awaiting_broadcast_text', None)
+    context.user_data['broadcast_text'] = text
 
     try:
-        cursor.execute("SELECT COUNT(*) FROM users")
-        total_users = cursor.fetchone()[0]
+        total = await db.count_broadcast_recipients()
+    except Exception as e:
+        logger.error(f"Ошибка при подсчете получателей рассылки: {e}")
+        await update.message.reply_text("Произошла ошибка при подготовке рассылки.")
+        return
 
-        cursor.execute("SELECT COUNT(*) FROM users WHERE is_approved = 1")
-        approved_users = cursor.fetchone()[0]
+    keyboard = [
+        [InlineKeyboardButton("✅ Отправить", callback_data="broadcast_confirm")],
+        [InlineKeyboardButton("🔙 Отмена", callback_data="moderation_panel")]
+    ]
+    await update.message.reply_text(
+        f"📣 Рассылка для {total} пользователей:\n\n{text}",
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+async def broadcast_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
 
-        cursor.execute("SELECT COUNT(*) FROM users WHERE is_active = 0")
-        banned_users = cursor.fetchone()[0]
+    user_id = update.effective_user.id
+    if not is_admin(user_id):
+        await query.answer("У вас нет прав для этого действия!")
+        return
 
-        cursor.execute("SELECT COUNT(*) FROM users WHERE is_under_review = 1")
-        pending_review = cursor.fetchone()[0]
+    text = context.user_data.pop('broadcast_text', None)
+    if not text:
+        await query.answer("Рассылка уже запущена или отменена.")
+        return
 
-        cursor.execute("SELECT COUNT(*) FROM matches")
-        total_matches = cursor.fetchone()[0]
+    await query.answer()
+    try:
+        await query.edit_message_text("📣 Рассылка запускается…")
+        broadcast_id = await broadcasts.begin(user_id, text, query.message.chat_id, query.message.message_id)
+        logger.info(f"Администратор {user_id} запустил рассылку {broadcast_id}")
+    except Exception as e:
+        logger.error(f"Ошибка при запуске рассылки: {e}")
+        await query.message.reply_text("Произошла ошибка при запуске рассылки.")
 
-        cursor.execute("SELECT COUNT(*) FROM likes")
-        total_likes = cursor.fetchone()[0]
+async def broadcast_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
 
-        cursor.execute("SELECT COUNT(*) FROM reports WHERE status = 'accepted'")
-        accepted_reports = cursor.fetchone()[0]
+    user_id = update.effective_user.id
+    if not is_admin(user_id):
+        await query.answer("У вас нет прав для этого действия!")
+        return
 
-        cursor.execute("SELECT COUNT(*) FROM reports WHERE status = 'pending'")
-        pending_reports = cursor.fetchone()[0]
+    broadcast_id = int(query.data.split('_')[2])
+    if broadcasts.cancel(broadcast_id):
+        await query.answer("⛔ Рассылка будет остановлена")
+    else:
+        await query.answer("Рассылка уже завершена.")
 
-        cursor.execute("SELECT COUNT(*) FROM admin_actions")
-        total_actions = cursor.fetchone()[0]
+async def moderation_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    await query.answer()
+
+    user_id = update.effective_user.id
+    if not is_admin(user_id):
+        return
+
+    try:
+        (total_users, approved_users, banned_users, pending_review, total_matches,
+         total_likes, accepted_reports, pending_reports, total_actions) = await db.get_moderation_stats()
 
         stats_text = (
             "📊 Детальная статистика модерации:\n\n"
@@ -2533,8 +1990,6 @@ async def moderation_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.error(f"Ошибка при получении статистики: {e}")
         stats_text = "📊 Статистика\n\nНе удалось получить данные статистики."
 
-    conn.close()
-
     keyboard = [[InlineKeyboardButton("🔙 Назад", callback_data="moderation_panel")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
 
@@ -2545,13 +2000,144 @@ async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     await start(update, context)
 
-def main():
-    init_db()
+async def on_startup(application: Application):
+    await db.start()
+    if shard.sharded:
+        await shard_refresher.start(db, apply_shard_changes, reload_shard_state, prune=shard.index == 0)
+    else:
+        await shard_refresher.start(db, prune=True)
+    await eligibility.load(db)
+    await ranking.load(db)
+    await seen.load()
+    await seen.start()
+    photo_pipeline.start()
+    await photo_index.load(db)
+    await outbox.start(application.bot)
+    await admin_digest.start(ADMIN_IDS)
+    await like_notifier.start()
+    await broadcasts.start(application.bot)
+    await user_state.start(application)
+    if not shard.sharded:
+        await web_server.start()
+    if shard.index == 0:
+        application.create_task(photo_index.backfill(db, photo_pipeline))
+
+async def on_shutdown(application: Application):
+    await web_server.stop()
+    await shard_refresher.stop()
+    await user_state.stop()
+    await broadcasts.stop()
+    await like_notifier.stop()
+    await admin_digest.stop()
+    await outbox.stop()
+    await photo_pipeline.stop()
+    await seen.stop()
+    await db.stop()
+
+async def reload_shard_state():
+    await eligibility.load(db)
+    seen.reindex()
+    await ranking.load(db)
+    await photo_index.load(db)
+    cards.clear()
+
+async def apply_shard_changes(changes):
+    user_ids = set()
+    photo_hashes = set()
+    for _, kind, subject, obj in changes:
+        if kind == 'user':
+            user_ids.add(subject)
+        elif kind == 'like':
+            eligibility.add_like(subject, obj)
+        elif kind == 'unlike':
+            eligibility.remove_like(subject, obj)
+        elif kind == 'photo':
+            photo_hashes.add(subject)
+
+    if user_ids:
+        rows = {row[0]: row for row in await db.get_shard_user_rows(list(user_ids))}
+        for user_id in user_ids:
+            cards.bump(user_id)
+            row = rows.get(user_id)
+            if row is None:
+                eligibility.remove_user(user_id)
+                ranking.remove_profile(user_id)
+                continue
+            _, is_active, is_approved, gender, interests, hobby, favorite_subject = row
+            eligibility.update_user(user_id, is_active=is_active, is_approved=is_approved, gender=gender)
+            if is_active and is_approved:
+                ranking.update_profile(user_id, interests, hobby, favorite_subject)
+            else:
+                ranking.remove_profile(user_id)
 
-    flask_thread = Thread(target=run_flask, daemon=True)
-    flask_thread.start()
+    if photo_hashes:
+        phashes = dict(await db.get_photo_phashes_for(list(photo_hashes)))
+        for digest in photo_hashes:
+            if digest in phashes:
+                photo_index.add(digest, phashes[digest])
+            else:
+                photo_index.remove(digest)
 
-    application = Application.builder().token(BOT_TOKEN).build()
+async def serve_updates(application: Application, source):
+    await application.initialize()
+    await on_startup(application)
+    try:
+        await application.start()
+        await source.start(application)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await source.stop()
+            await application.stop()
+    finally:
+        await application.shutdown()
+        await on_shutdown(application)
+
+def run_shard(index, count):
+    shard.configure(index, count)
+    likes.verify = True
+    db.open()
+    try:
+        asyncio.run(serve_updates(build_application(), ShardServer(index)))
+    except KeyboardInterrupt:
+        pass
+    db.close()
+
+async def run_front(count):
+    context = multiprocessing.get_context('spawn')
+
+    def spawn(index):
+        process = context.Process(target=run_shard, args=(index, count), name=f"shard-{index}")
+        process.start()
+        return process
+
+    router = ShardRouter(WEBHOOK_SECRET, count, spawn)
+    server = WebServer(router, router.stats)
+    await router.start()
+    await server.start()
+    try:
+        async with Bot(BOT_TOKEN) as bot:
+            if WEBHOOK_URL:
+                await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET, allowed_updates=Update.ALL_TYPES)
+                await asyncio.Event().wait()
+            else:
+                await bot.delete_webhook()
+                await router.poll(bot)
+    finally:
+        await server.stop()
+        await router.stop()
+
+def build_application():
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .update_queue(asyncio.Queue(maxsize=WEBHOOK_QUEUE_SIZE))
+        .concurrent_updates(update_processor)
+        .persistence(user_state)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+        .build()
+    )
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("menu", menu_command))
@@ -2569,6 +2155,7 @@ def main():
     application.add_handler(CallbackQueryHandler(view_anonymous_profile, pattern="^view_anonymous_"))
     application.add_handler(CallbackQueryHandler(like_anonymous_user, pattern="^like_anonymous_"))
     application.add_handler(CallbackQueryHandler(my_matches, pattern="^my_matches$"))
+    application.add_handler(CallbackQueryHandler(page_navigation, pattern="^page_"))
     application.add_handler(CallbackQueryHandler(view_match, pattern="^view_match_"))
 
     application.add_handler(CallbackQueryHandler(moderation_panel, pattern="^moderation_panel$"))
@@ -2583,6 +2170,9 @@ def main():
     application.add_handler(CallbackQueryHandler(moderation_stats, pattern="^moderation_stats$"))
     application.add_handler(CallbackQueryHandler(debug_moderation, pattern="^debug_moderation$"))
     application.add_handler(CallbackQueryHandler(fix_moderation, pattern="^fix_moderation$"))
+    application.add_handler(CallbackQueryHandler(broadcast_menu, pattern="^broadcast_menu$"))
+    application.add_handler(CallbackQueryHandler(broadcast_confirm, pattern="^broadcast_confirm$"))
+    application.add_handler(CallbackQueryHandler(broadcast_cancel, pattern="^broadcast_cancel_"))
     application.add_handler(CallbackQueryHandler(main_menu, pattern="^main_menu$"))
 
     application.add_handler(CallbackQueryHandler(report_user_menu, pattern="^report_user_menu$"))
@@ -2607,16 +2197,46 @@ def main():
 
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_profile_creation))
     application.add_handler(MessageHandler(filters.PHOTO, handle_photo))
+    return application
+
+def main():
+    run_migrations()
+    problems = check_query_plans()
+    if problems and STRICT_QUERY_PLANS:
+        raise SystemExit(f"Запросы не используют индексы: {', '.join(problems)}")
 
     print("=" * 50)
     print("🤖 Бот знакомств для школы")
     print("=" * 50)
     print("Бот запущен...")
-    print("Flask сервер запущен на порту 8080")
+    print(f"Режим получения обновлений: {'вебхук' if WEBHOOK_URL else 'polling'}")
+    if SHARDS > 1:
+        print(f"Шардов: {SHARDS}")
+    print("HTTP сервер запущен на порту 8080")
+    print(f"Метрики доступны только локально: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
     print("Используйте /start для начала работы")
     print("=" * 50)
 
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if WEBHOOK_URL and not WEBHOOK_SECRET:
+        raise SystemExit("Для режима вебхука нужно задать WEBHOOK_SECRET")
+
+    if SHARDS > 1:
+        try:
+            asyncio.run(run_front(SHARDS))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    db.open()
+    application = build_application()
+    if WEBHOOK_URL:
+        try:
+            asyncio.run(serve_updates(application, webhook_ingress))
+        except KeyboardInterrupt:
+            pass
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+    db.close()
 
 if __name__ == '__main__':
 
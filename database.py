@@ -0,0 +1,709 @@
+import asyncio
+import logging
+import queue
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DB_PATH = 'school_dating.db'
+POOL_SIZE = 4
+BUSY_TIMEOUT_MS = 5000
+WRITE_BATCH_SIZE = 64
+WRITE_BATCH_DELAY = 0.005
+
+PAGE_SOURCES = {
+    'received': [(
+        '''
+        SELECT u.user_id, u.username, u.first_name, u.last_name, u.class, l.liked_at, l.id
+        FROM likes l
+        JOIN users u ON l.from_user_id = u.user_id
+        WHERE l.to_user_id = ?
+        ''',
+        'l', 'liked_at', 'likes'
+    )],
+    'given': [(
+        '''
+        SELECT u.user_id, u.username, u.first_name, u.last_name, u.class, l.liked_at, l.id
+        FROM likes l
+        JOIN users u ON l.to_user_id = u.user_id
+        WHERE l.from_user_id = ?
+        ''',
+        'l', 'liked_at', 'likes'
+    )],
+    'matches': [
+        (
+            '''
+            SELECT u.user_id, u.username, u.first_name, u.last_name, u.class, m.matched_at, m.id
+            FROM matches m
+            JOIN users u ON u.user_id = m.user2_id
+            WHERE m.user1_id = ? AND m.status = 'active'
+            ''',
+            'm', 'matched_at', 'matches'
+        ),
+        (
+            '''
+            SELECT u.user_id, u.username, u.first_name, u.last_name, u.class, m.matched_at, m.id
+            FROM matches m
+            JOIN users u ON u.user_id = m.user1_id
+            WHERE m.user2_id = ? AND m.status = 'active'
+            ''',
+            'm', 'matched_at', 'matches'
+        ),
+    ],
+}
+
+
+def keyset_sql(source, after_cursor, backwards):
+    select, alias, column, table = source
+    order = 'ASC' if backwards else 'DESC'
+    condition = ''
+    if after_cursor:
+        operator = '>' if backwards else '<'
+        condition = f"AND ({alias}.{column}, {alias}.id) {operator} (SELECT {column}, id FROM {table} WHERE id = ?)"
+    return f"{select} {condition} ORDER BY {alias}.{column} {order}, {alias}.id {order} LIMIT ?"
+
+
+HOT_QUERIES = {
+    'has_liked': (
+        '''
+        SELECT id FROM likes
+        WHERE from_user_id = ? AND to_user_id = ?
+        ''',
+        'idx_likes_from_to'
+    ),
+    'likes_received': (keyset_sql(PAGE_SOURCES['received'][0], True, False), 'idx_likes_to_liked_at'),
+    'likes_given': (keyset_sql(PAGE_SOURCES['given'][0], True, False), 'idx_likes_from_liked_at'),
+    'matches_as_user1': (keyset_sql(PAGE_SOURCES['matches'][0], True, False), 'idx_matches_user1'),
+    'matches_as_user2': (keyset_sql(PAGE_SOURCES['matches'][1], True, False), 'idx_matches_user2'),
+    'pending_report_exists': (
+        '''
+        SELECT id FROM reports
+        WHERE reporter_id = ? AND reported_user_id = ? AND status = 'pending'
+        ''',
+        'idx_reports_reporter'
+    ),
+    'next_report': (
+        '''
+        SELECT r.id, r.reporter_id, r.reported_user_id, r.reason, r.reported_at,
+               u1.first_name as reporter_name, u2.first_name as reported_name
+        FROM reports r
+        LEFT JOIN users u1 ON r.reporter_id = u1.user_id
+        LEFT JOIN users u2 ON r.reported_user_id = u2.user_id
+        WHERE r.status = 'pending'
+        ORDER BY r.reported_at ASC
+        LIMIT 1
+        ''',
+        'idx_reports_status_reported_at'
+    ),
+    'next_profile_for_review': (
+        '''
+        SELECT user_id
+        FROM users
+        WHERE is_under_review = 1
+        ORDER BY registered_at ASC
+        LIMIT 1
+        ''',
+        'idx_users_review_registered'
+    ),
+    'broadcast_recipients': (
+        '''
+        SELECT user_id FROM users
+        WHERE user_id > ? AND is_approved = 1 AND is_active = 1
+        ORDER BY user_id
+        LIMIT ?
+        ''',
+        'INTEGER PRIMARY KEY'
+    ),
+}
+
+PROFILE_FIELDS = (
+    'first_name', 'last_name', 'class', 'interests', 'favorite_subject',
+    'hobby', 'dream', 'about_me', 'gender', 'search_gender', 'photo_path'
+)
+
+
+class Database:
+    def __init__(self, path=DB_PATH, pool_size=POOL_SIZE):
+        self.path = path
+        self.pool_size = pool_size
+        self._pool = queue.Queue()
+        self._executor = None
+        self._writer_conn = None
+        self._writer_executor = None
+        self._write_queue = None
+        self._writer_task = None
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        return conn
+
+    def open(self):
+        if self._executor is not None:
+            return
+        self._writer_conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._writer_conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        self._writer_conn.execute("PRAGMA journal_mode = WAL")
+        self._writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        for _ in range(self.pool_size):
+            self._pool.put(self._connect())
+        self._executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='db')
+        logger.info(f"Пул соединений с базой данных открыт ({self.pool_size})")
+
+    async def start(self):
+        if self._writer_task is not None:
+            return
+        self.open()
+        self._write_queue = asyncio.Queue()
+        self._writer_task = asyncio.create_task(self._writer_loop())
+
+    async def stop(self):
+        if self._writer_task is None:
+            return
+        await self._write_queue.put(None)
+        await self._writer_task
+        self._writer_task = None
+        self._write_queue = None
+
+    def close(self):
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=True)
+        self._executor = None
+        while not self._pool.empty():
+            self._pool.get_nowait().close()
+        self._writer_executor.shutdown(wait=True)
+        self._writer_executor = None
+        self._writer_conn.close()
+        self._writer_conn = None
+        logger.info("Пул соединений с базой данных закрыт")
+
+    def _call(self, func, args):
+        conn = self._pool.get()
+        try:
+            return func(conn, *args)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._pool.put(conn)
+
+    async def run(self, func, *args):
+        if self._executor is None:
+            self.open()
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, func, args)
+
+    async def write(self, func):
+        if self._writer_task is None:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._write_queue.put((func, future))
+        return await future
+
+    async def _writer_loop(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+
+        while not stopping:
+            item = await self._write_queue.get()
+            if item is None:
+                break
+
+            batch = [item]
+            stopping = self._drain_write_queue(batch)
+            if not stopping and len(batch) < WRITE_BATCH_SIZE:
+                await asyncio.sleep(WRITE_BATCH_DELAY)
+                stopping = self._drain_write_queue(batch)
+
+            try:
+                results = await loop.run_in_executor(
+                    self._writer_executor, self._commit_batch, [func for func, _ in batch]
+                )
+            except Exception as e:
+                logger.error(f"Ошибка при записи пакета из {len(batch)} операций: {e}")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            for (_, future), (result, error) in zip(batch, results):
+                if future.done():
+                    continue
+                if error is not None:
+                    future.set_exception(error)
+                else:
+                    future.set_result(result)
+
+    def _drain_write_queue(self, batch):
+        while len(batch) < WRITE_BATCH_SIZE:
+            try:
+                item = self._write_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return False
+            if item is None:
+                return True
+            batch.append(item)
+        return False
+
+    def _commit_batch(self, funcs):
+        conn = self._writer_conn
+        results = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for func in funcs:
+                conn.execute("SAVEPOINT write_op")
+                try:
+                    result = func(conn)
+                except Exception as e:
+                    conn.execute("ROLLBACK TO write_op")
+                    conn.execute("RELEASE write_op")
+                    results.append((None, e))
+                else:
+                    conn.execute("RELEASE write_op")
+                    results.append((result, None))
+            conn.execute("COMMIT")
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        return results
+
+    async def fetchone(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def execute(self, sql, params=()):
+        return await self.write(lambda conn: conn.execute(sql, params).rowcount)
+
+    async def user_exists(self, user_id):
+        return await self.fetchone("SELECT user_id FROM users WHERE user_id = ?", (user_id,)) is not None
+
+    async def get_user_status(self, user_id):
+        return await self.fetchone(
+            "SELECT is_approved, is_under_review, is_active FROM users WHERE user_id = ?", (user_id,)
+        )
+
+    async def get_user_approval(self, user_id):
+        return await self.fetchone("SELECT user_id, is_approved FROM users WHERE user_id = ?", (user_id,))
+
+    async def get_search_settings(self, user_id):
+        return await self.fetchone("SELECT search_gender, gender FROM users WHERE user_id = ?", (user_id,))
+
+    async def get_user_contacts(self, *user_ids):
+        placeholders = ', '.join('?' * len(user_ids))
+        rows = await self.fetchall(
+            f"SELECT user_id, username, first_name, last_name FROM users WHERE user_id IN ({placeholders})", user_ids
+        )
+        return {row[0]: row[1:] for row in rows}
+
+    async def get_user_brief(self, user_id):
+        return await self.fetchone("SELECT first_name, last_name, class FROM users WHERE user_id = ?", (user_id,))
+
+    async def get_profile_card_row(self, user_id):
+        return await self.fetchone('''
+            SELECT user_id, username, first_name, last_name, class, interests, about_me, gender, search_gender,
+                   favorite_subject, hobby, dream, registered_at, photo_path, photo_file_id, photo_hash
+            FROM users WHERE user_id = ?
+        ''', (user_id,))
+
+    async def save_profile(self, user_id, username, user_data):
+        return await self.execute('''
+            INSERT OR REPLACE INTO users
+            (user_id, username, first_name, last_name, class, interests, about_me, gender, search_gender,
+             favorite_subject, hobby, dream, registered_at, is_under_review, is_approved, is_active)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            user_id,
+            username,
+            user_data.get('first_name'),
+            user_data.get('last_name'),
+            user_data.get('class'),
+            user_data.get('interests'),
+            user_data.get('about_me'),
+            user_data.get('gender'),
+            user_data.get('search_gender', 'все'),
+            user_data.get('favorite_subject'),
+            user_data.get('hobby'),
+            user_data.get('dream'),
+            datetime.now(),
+            1,
+            0,
+            1
+        ))
+
+    async def update_profile_field(self, user_id, field, value):
+        if field not in PROFILE_FIELDS:
+            raise ValueError(f"Недопустимое поле анкеты: {field}")
+        return await self.execute(f"UPDATE users SET {field} = ? WHERE user_id = ?", (value, user_id))
+
+    async def set_photo(self, user_id, photo_path, file_id, photo_hash):
+        return await self.execute(
+            "UPDATE users SET photo_path = ?, photo_file_id = ?, photo_hash = ? WHERE user_id = ?",
+            (photo_path, file_id, photo_hash, user_id)
+        )
+
+    async def set_photo_file_id(self, user_id, file_id):
+        return await self.execute(
+            "UPDATE users SET photo_file_id = ? WHERE user_id = ? AND photo_file_id IS NULL", (file_id, user_id)
+        )
+
+    async def get_user_photo(self, user_id):
+        return await self.fetchone("SELECT photo_path, photo_hash FROM users WHERE user_id = ?", (user_id,))
+
+    async def add_photo(self, photo_hash, path, width, height, size, phash):
+        return await self.execute('''
+            INSERT INTO photos (hash, path, width, height, size, phash, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (hash) DO NOTHING
+        ''', (photo_hash, path, width, height, size, phash, datetime.now()))
+
+    async def get_photo_phashes(self):
+        return await self.fetchall("SELECT hash, phash FROM photos WHERE phash IS NOT NULL")
+
+    async def get_photos_without_phash(self):
+        return await self.fetchall("SELECT hash, path FROM photos WHERE phash IS NULL")
+
+    async def set_photo_phash(self, photo_hash, phash):
+        return await self.execute("UPDATE photos SET phash = ? WHERE hash = ?", (phash, photo_hash))
+
+    async def get_photo_owners(self, photo_hashes, exclude_user_id):
+        placeholders = ', '.join('?' * len(photo_hashes))
+        return await self.fetchall(f'''
+            SELECT user_id, first_name, last_name, is_active, is_approved, photo_hash
+            FROM users
+            WHERE photo_hash IN ({placeholders}) AND user_id != ?
+        ''', (*photo_hashes, exclude_user_id))
+
+    async def delete_unused_photo(self, photo_hash):
+        return await self.execute('''
+            DELETE FROM photos
+            WHERE hash = ? AND NOT EXISTS (SELECT 1 FROM users WHERE photo_hash = ?)
+        ''', (photo_hash, photo_hash)) > 0
+
+    async def delete_user(self, user_id):
+        def _delete_user(conn):
+            conn.execute("DELETE FROM users WHERE user_id = ?", (user_id,))
+            conn.execute("DELETE FROM likes WHERE from_user_id = ? OR to_user_id = ?", (user_id, user_id))
+            conn.execute("DELETE FROM matches WHERE user1_id = ? OR user2_id = ?", (user_id, user_id))
+            conn.execute("DELETE FROM seen_profiles WHERE user_id = ?", (user_id,))
+        return await self.write(_delete_user)
+
+    async def get_eligibility_rows(self):
+        return await self.fetchall("SELECT user_id, is_active, is_approved, gender FROM users")
+
+    async def get_ranking_texts(self, user_id=None):
+        if user_id is not None:
+            return await self.fetchone(
+                "SELECT user_id, interests, hobby, favorite_subject FROM users WHERE user_id = ?", (user_id,)
+            )
+        return await self.fetchall(
+            "SELECT user_id, interests, hobby, favorite_subject FROM users WHERE is_approved = 1 AND is_active = 1"
+        )
+
+    async def get_seen_filters(self):
+        return await self.fetchall("SELECT user_id, bloom, seen_count FROM seen_profiles")
+
+    async def save_seen_filters(self, rows, removed=()):
+        def _save_seen_filters(conn):
+            now = datetime.now()
+            conn.executemany('''
+                INSERT INTO seen_profiles (user_id, bloom, seen_count, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    bloom = excluded.bloom, seen_count = excluded.seen_count, updated_at = excluded.updated_at
+            ''', [(user_id, bloom, seen_count, now) for user_id, bloom, seen_count in rows])
+            conn.executemany("DELETE FROM seen_profiles WHERE user_id = ?", [(user_id,) for user_id in removed])
+        return await self.write(_save_seen_filters)
+
+    async def add_outbox_message(self, chat_id, text, reply_markup):
+        def _add_outbox_message(conn):
+            return conn.execute('''
+                INSERT INTO outbox (chat_id, text, reply_markup, attempts, next_attempt_at, status, created_at)
+                VALUES (?, ?, ?, 0, 0, 'pending', ?)
+            ''', (chat_id, text, reply_markup, datetime.now())).lastrowid
+        return await self.write(_add_outbox_message)
+
+    async def get_due_outbox_messages(self, now, limit, shard_index=0, shard_count=1):
+        return await self.fetchall('''
+            SELECT id, chat_id, text, reply_markup, attempts
+            FROM outbox
+            WHERE status = 'pending' AND next_attempt_at <= ? AND abs(chat_id) % ? = ?
+            ORDER BY next_attempt_at, id
+            LIMIT ?
+        ''', (now, shard_count, shard_index, limit))
+
+    async def reschedule_outbox_message(self, message_id, attempts, next_attempt_at, error):
+        return await self.execute(
+            "UPDATE outbox SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?",
+            (attempts, next_attempt_at, error, message_id)
+        )
+
+    async def fail_outbox_message(self, message_id, error):
+        return await self.execute(
+            "UPDATE outbox SET status = 'failed', last_error = ? WHERE id = ?", (error, message_id)
+        )
+
+    async def delete_outbox_message(self, message_id):
+        return await self.execute("DELETE FROM outbox WHERE id = ?", (message_id,))
+
+    async def count_broadcast_recipients(self):
+        row = await self.fetchone("SELECT COUNT(*) FROM users WHERE is_approved = 1 AND is_active = 1")
+        return row[0]
+
+    async def get_broadcast_recipients(self, after_user_id, limit):
+        rows = await self.fetchall(HOT_QUERIES['broadcast_recipients'][0], (after_user_id, limit))
+        return [row[0] for row in rows]
+
+    async def create_broadcast(self, admin_id, text, total, status_chat_id, status_message_id):
+        def _create_broadcast(conn):
+            return conn.execute('''
+                INSERT INTO broadcasts (admin_id, text, status, total, status_chat_id, status_message_id, started_at)
+                VALUES (?, ?, 'running', ?, ?, ?, ?)
+            ''', (admin_id, text, total, status_chat_id, status_message_id, datetime.now())).lastrowid
+        return await self.write(_create_broadcast)
+
+    async def get_running_broadcasts(self, shard_index=0, shard_count=1):
+        return await self.fetchall('''
+            SELECT id, text, last_user_id, sent, failed, total, status_chat_id, status_message_id
+            FROM broadcasts
+            WHERE status = 'running' AND abs(admin_id) % ? = ?
+            ORDER BY id
+        ''', (shard_count, shard_index))
+
+    async def save_broadcast_progress(self, broadcast_id, last_user_id, sent, failed):
+        return await self.execute(
+            "UPDATE broadcasts SET last_user_id = ?, sent = ?, failed = ? WHERE id = ?",
+            (last_user_id, sent, failed, broadcast_id)
+        )
+
+    async def finish_broadcast(self, broadcast_id, status):
+        return await self.execute(
+            "UPDATE broadcasts SET status = ?, finished_at = ? WHERE id = ?",
+            (status, datetime.now(), broadcast_id)
+        )
+
+    async def get_user_state(self, user_id):
+        return await self.fetchall("SELECT key, value FROM user_state WHERE user_id = ?", (user_id,))
+
+    async def save_user_state(self, changed, removed):
+        def _save_user_state(conn):
+            now = datetime.now()
+            conn.executemany('''
+                INSERT INTO user_state (user_id, key, value, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (user_id, key) DO UPDATE SET value = excluded.value, updated_at = excluded.updated_at
+            ''', [(user_id, key, value, now) for user_id, key, value in changed])
+            conn.executemany("DELETE FROM user_state WHERE user_id = ? AND key = ?", removed)
+        return await self.write(_save_user_state)
+
+    async def delete_user_state(self, user_id):
+        return await self.execute("DELETE FROM user_state WHERE user_id = ?", (user_id,))
+
+    async def get_all_likes(self):
+        return await self.fetchall("SELECT from_user_id, to_user_id FROM likes")
+
+    async def get_shard_watermark(self):
+        return (await self.fetchone(
+            "SELECT COALESCE((SELECT seq FROM sqlite_sequence WHERE name = 'shard_changes'), 0)"
+        ))[0]
+
+    async def get_shard_changes(self, after_id, limit):
+        return await self.fetchall(
+            "SELECT id, kind, subject, object FROM shard_changes WHERE id > ? ORDER BY id LIMIT ?", (after_id, limit)
+        )
+
+    async def prune_shard_changes(self, retention_seconds):
+        return await self.execute(
+            "DELETE FROM shard_changes WHERE changed_at < datetime('now', ?)", (f"-{int(retention_seconds)} seconds",)
+        )
+
+    async def get_shard_user_rows(self, user_ids):
+        placeholders = ', '.join('?' * len(user_ids))
+        return await self.fetchall(f'''
+            SELECT user_id, is_active, is_approved, gender, interests, hobby, favorite_subject
+            FROM users WHERE user_id IN ({placeholders})
+        ''', tuple(user_ids))
+
+    async def get_photo_phashes_for(self, photo_hashes):
+        placeholders = ', '.join('?' * len(photo_hashes))
+        return await self.fetchall(
+            f"SELECT hash, phash FROM photos WHERE hash IN ({placeholders}) AND phash IS NOT NULL", tuple(photo_hashes)
+        )
+
+    async def record_like(self, from_user_id, to_user_id, mutual=None):
+        def _record_like(conn):
+            now = datetime.now()
+            created = conn.execute('''
+                INSERT INTO likes (from_user_id, to_user_id, liked_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT (from_user_id, to_user_id) DO NOTHING
+            ''', (from_user_id, to_user_id, now)).rowcount > 0
+            is_mutual = mutual
+            if created and is_mutual is None:
+                is_mutual = conn.execute(
+                    HOT_QUERIES['has_liked'][0], (to_user_id, from_user_id)
+                ).fetchone() is not None
+            if created and is_mutual:
+                conn.execute('''
+                    INSERT INTO matches (user1_id, user2_id, matched_at)
+                    VALUES (?, ?, ?)
+                ''', (min(from_user_id, to_user_id), max(from_user_id, to_user_id), now))
+            return created, bool(created and is_mutual)
+        return await self.write(_record_like)
+
+    async def get_page(self, kind, user_id, cursor=None, backwards=False, limit=10):
+        sources = PAGE_SOURCES[kind]
+        params = []
+        parts = []
+        for source in sources:
+            parts.append(f"SELECT * FROM ({keyset_sql(source, cursor is not None, backwards)})")
+            params.extend((user_id, cursor, limit) if cursor is not None else (user_id, limit))
+
+        order = 'ASC' if backwards else 'DESC'
+        sql = " UNION ALL ".join(parts) + f" ORDER BY 6 {order}, 7 {order} LIMIT ?"
+        rows = await self.fetchall(sql, (*params, limit))
+        return rows[::-1] if backwards else rows
+
+    async def has_pending_report(self, reporter_id, reported_user_id):
+        return await self.fetchone(
+            HOT_QUERIES['pending_report_exists'][0], (reporter_id, reported_user_id)
+        ) is not None
+
+    async def add_report(self, reporter_id, reported_user_id, reason):
+        def _add_report(conn):
+            conn.execute('''
+                INSERT INTO reports (reporter_id, reported_user_id, reason, reported_at, status)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (reporter_id, reported_user_id, reason, datetime.now(), 'pending'))
+            conn.execute('''
+                UPDATE users
+                SET reported_count = reported_count + 1, last_reported = ?
+                WHERE user_id = ?
+            ''', (datetime.now(), reported_user_id))
+        return await self.write(_add_report)
+
+    async def get_next_report(self):
+        return await self.fetchone(HOT_QUERIES['next_report'][0])
+
+    async def accept_report(self, admin_id, report_id):
+        def _accept_report(conn):
+            conn.execute("UPDATE reports SET status = 'accepted', reviewed_by = ?, reviewed_at = ? WHERE id = ?",
+                         (admin_id, datetime.now(), report_id))
+            reported_user_id = conn.execute('''
+                SELECT reported_user_id FROM reports WHERE id = ?
+            ''', (report_id,)).fetchone()[0]
+            conn.execute('''
+                UPDATE users SET reported_count = reported_count + 1, last_reported = ? WHERE user_id = ?
+            ''', (datetime.now(), reported_user_id))
+            conn.execute('''
+                INSERT INTO admin_actions (admin_id, action, target_user_id, details, action_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (admin_id, 'accept_report', reported_user_id, f'Жалоба #{report_id} принята', datetime.now()))
+            return reported_user_id
+        return await self.write(_accept_report)
+
+    async def dismiss_report(self, admin_id, report_id):
+        def _dismiss_report(conn):
+            conn.execute("UPDATE reports SET status = 'dismissed', reviewed_by = ?, reviewed_at = ? WHERE id = ?",
+                         (admin_id, datetime.now(), report_id))
+            conn.execute('''
+                INSERT INTO admin_actions (admin_id, action, target_user_id, details, action_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (admin_id, 'dismiss_report', 0, f'Жалоба #{report_id} отклонена', datetime.now()))
+        return await self.write(_dismiss_report)
+
+    async def get_users_columns(self):
+        return await self.fetchall("PRAGMA table_info(users)")
+
+    async def get_schema_version(self):
+        row = await self.fetchone("SELECT MAX(version) FROM schema_version")
+        return row[0] if row else 0
+
+    async def get_moderation_debug(self):
+        def _get_moderation_debug(conn):
+            pending_profiles = conn.execute(
+                "SELECT user_id, is_under_review, is_approved, first_name, class FROM users WHERE is_under_review = 1"
+            ).fetchall()
+            total_users = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+            recent_profiles = conn.execute(
+                "SELECT user_id, is_under_review, is_approved, is_active, first_name FROM users ORDER BY user_id DESC LIMIT 10"
+            ).fetchall()
+            return pending_profiles, total_users, recent_profiles
+        return await self.run(_get_moderation_debug)
+
+    async def fix_moderation_flags(self):
+        def _fix_moderation_flags(conn):
+            fixed_count = conn.execute(
+                "UPDATE users SET is_under_review = 1 WHERE is_approved = 0 AND (is_under_review = 0 OR is_under_review IS NULL)"
+            ).rowcount
+            pending_count = conn.execute("SELECT COUNT(*) FROM users WHERE is_under_review = 1").fetchone()[0]
+            wrong_state = conn.execute(
+                "SELECT COUNT(*) FROM users WHERE is_approved = 1 AND is_under_review = 1"
+            ).fetchone()[0]
+            if wrong_state > 0:
+                conn.execute("UPDATE users SET is_under_review = 0 WHERE is_approved = 1 AND is_under_review = 1")
+            return fixed_count, pending_count, wrong_state
+        return await self.write(_fix_moderation_flags)
+
+    async def get_moderation_counts(self):
+        def _get_moderation_counts(conn):
+            pending_count = conn.execute("SELECT COUNT(*) FROM users WHERE is_under_review = 1").fetchone()[0]
+            reports_count = conn.execute("SELECT COUNT(*) FROM reports WHERE status = 'pending'").fetchone()[0]
+            approved_users = conn.execute("SELECT COUNT(*) FROM users WHERE is_approved = 1").fetchone()[0]
+            banned_users = conn.execute("SELECT COUNT(*) FROM users WHERE is_active = 0").fetchone()[0]
+            return pending_count, reports_count, approved_users, banned_users
+        return await self.run(_get_moderation_counts)
+
+    async def get_moderation_stats(self):
+        def _get_moderation_stats(conn):
+            queries = (
+                "SELECT COUNT(*) FROM users",
+                "SELECT COUNT(*) FROM users WHERE is_approved = 1",
+                "SELECT COUNT(*) FROM users WHERE is_active = 0",
+                "SELECT COUNT(*) FROM users WHERE is_under_review = 1",
+                "SELECT COUNT(*) FROM matches",
+                "SELECT COUNT(*) FROM likes",
+                "SELECT COUNT(*) FROM reports WHERE status = 'accepted'",
+                "SELECT COUNT(*) FROM reports WHERE status = 'pending'",
+                "SELECT COUNT(*) FROM admin_actions",
+            )
+            return tuple(conn.execute(sql).fetchone()[0] for sql in queries)
+        return await self.run(_get_moderation_stats)
+
+    async def get_next_profile_for_review(self):
+        return await self.fetchone(HOT_QUERIES['next_profile_for_review'][0])
+
+    async def approve_profile(self, admin_id, target_user_id):
+        def _approve_profile(conn):
+            conn.execute("UPDATE users SET is_approved = 1, is_under_review = 0 WHERE user_id = ?", (target_user_id,))
+            conn.execute('''
+                INSERT INTO admin_actions (admin_id, action, target_user_id, details, action_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (admin_id, 'approve', target_user_id, 'Анкета одобрена', datetime.now()))
+        return await self.write(_approve_profile)
+
+    async def moderate_profile(self, admin_id, target_user_id, action_type, reason):
+        def _moderate_profile(conn):
+            if action_type == 'reject':
+                conn.execute("DELETE FROM users WHERE user_id = ?", (target_user_id,))
+                conn.execute("DELETE FROM likes WHERE from_user_id = ? OR to_user_id = ?",
+                             (target_user_id, target_user_id))
+                conn.execute("DELETE FROM matches WHERE user1_id = ? OR user2_id = ?", (target_user_id, target_user_id))
+                conn.execute("DELETE FROM seen_profiles WHERE user_id = ?", (target_user_id,))
+                conn.execute("DELETE FROM user_state WHERE user_id = ?", (target_user_id,))
+            else:
+                conn.execute("UPDATE users SET is_active = 0, is_approved = 0, is_under_review = 0 WHERE user_id = ?",
+                             (target_user_id,))
+
+            conn.execute('''
+                INSERT INTO admin_actions (admin_id, action, target_user_id, details, action_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (admin_id, action_type, target_user_id, f"Причина: {reason}", datetime.now()))
+        return await self.write(_moderate_profile)
+
+
+db = Database()
@@ -0,0 +1,151 @@
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from collections import deque
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+DISPATCH_CONCURRENCY = 32
+DISPATCH_MAX_PENDING = 1024
+DISPATCH_STATS_KEYS = 10
+SLOW_WAIT_SECONDS = 5.0
+STATS_KEY_SALT = os.urandom(16)
+
+
+class KeyState:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth = 0
+        self.waits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.queued = deque()
+
+
+def stats_key(key):
+    return hashlib.blake2b(str(key).encode(), key=STATS_KEY_SALT, digest_size=6).hexdigest()
+
+
+def update_key(update):
+    if isinstance(update, Update):
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+    return None
+
+
+class UserOrderedProcessor(BaseUpdateProcessor):
+    def __init__(self, concurrency=DISPATCH_CONCURRENCY, max_pending=DISPATCH_MAX_PENDING):
+        super().__init__(max_pending)
+        self.concurrency = concurrency
+        self.running = 0
+        self.waiting = 0
+        self.processed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.on_done = None
+        self._slots = None
+        self._keys = {}
+
+    async def initialize(self):
+        self._slots = asyncio.Semaphore(self.concurrency)
+
+    async def shutdown(self):
+        pass
+
+    async def do_process_update(self, update, coroutine):
+        finished = False
+        try:
+            await self._dispatch(update, coroutine)
+            finished = True
+        except Exception:
+            finished = True
+            raise
+        finally:
+            if finished and self.on_done is not None:
+                self.on_done(update)
+
+    async def _dispatch(self, update, coroutine):
+        key = update_key(update)
+        queued_at = time.monotonic()
+        self.waiting += 1
+        if key is None:
+            await self._run(None, queued_at, coroutine)
+            return
+
+        state = self._keys.get(key)
+        if state is None:
+            state = self._keys[key] = KeyState()
+        state.depth += 1
+        state.queued.append(queued_at)
+        started = False
+        try:
+            async with state.lock:
+                started = True
+                state.queued.popleft()
+                await self._run(state, queued_at, coroutine)
+        finally:
+            if not started:
+                state.queued.remove(queued_at)
+                self.waiting -= 1
+            state.depth -= 1
+            if state.depth == 0:
+                self._keys.pop(key, None)
+
+    async def _run(self, state, queued_at, coroutine):
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        try:
+            wait = time.monotonic() - queued_at
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            if state is not None:
+                state.waits += 1
+                state.total_wait += wait
+                state.max_wait = max(state.max_wait, wait)
+            if wait >= SLOW_WAIT_SECONDS:
+                logger.warning(f"Обновление ждало обработки {wait:.1f} с")
+
+            self.running += 1
+            try:
+                await coroutine
+            finally:
+                self.running -= 1
+                self.processed += 1
+        finally:
+            self._slots.release()
+
+    def stats(self):
+        now = time.monotonic()
+        deepest = sorted(self._keys.items(), key=lambda item: item[1].depth, reverse=True)[:DISPATCH_STATS_KEYS]
+        return {
+            "running": self.running,
+            "concurrency": self.concurrency,
+            "queued": self.waiting,
+            "active_keys": len(self._keys),
+            "processed": self.processed,
+            "avg_wait": self.total_wait / self.processed if self.processed else 0.0,
+            "max_wait": self.max_wait,
+            "max_depth": max((state.depth for state in self._keys.values()), default=0),
+            "keys": [
+                {
+                    "key": stats_key(key),
+                    "depth": state.depth,
+                    "avg_wait": state.total_wait / state.waits if state.waits else 0.0,
+                    "max_wait": state.max_wait,
+                    "oldest_wait": now - state.queued[0] if state.queued else 0.0,
+                }
+                for key, state in deepest
+            ],
+        }
+
+
+update_processor = UserOrderedProcessor()
@@ -0,0 +1,64 @@
+import argparse
+import json
+import time
+import urllib.error
+import urllib.request
+
+
+def build_update(update_id, user_id, text):
+    user = {"id": user_id, "is_bot": False, "first_name": f"Тест {user_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": user["first_name"]},
+            "from": user,
+            "text": text,
+            "entities": [{"type": "bot_command", "offset": 0, "length": len(text)}] if text.startswith('/') else [],
+        },
+    }
+
+
+def send(url, secret, update):
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(update).encode(),
+        headers={"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": secret},
+        method="POST",
+    )
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request) as response:
+            status = response.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    return status, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Отправка тестовых обновлений на локальный вебхук")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook")
+    parser.add_argument("--secret", required=True)
+    parser.add_argument("--count", type=int, default=10)
+    parser.add_argument("--users", type=int, default=1)
+    parser.add_argument("--user-id", type=int, default=100000)
+    parser.add_argument("--text", default="/start")
+    args = parser.parse_args()
+
+    latencies = []
+    statuses = {}
+    for i in range(args.count):
+        update = build_update(int(time.time() * 1000) % 10 ** 9 + i, args.user_id + i % args.users, args.text)
+        status, latency = send(args.url, args.secret, update)
+        statuses[status] = statuses.get(status, 0) + 1
+        latencies.append(latency)
+
+    latencies.sort()
+    print(f"Отправлено: {args.count}, ответы: {statuses}")
+    print(f"Задержка ответа: медиана {latencies[len(latencies) // 2] * 1000:.2f} мс, "
+          f"максимум {latencies[-1] * 1000:.2f} мс")
+
+
+if __name__ == '__main__':
+    main()
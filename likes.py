@@ -0,0 +1,35 @@
+import logging
+
+from database import db
+from matching import eligibility
+
+logger = logging.getLogger(__name__)
+
+
+class LikeService:
+    def __init__(self, database, index):
+        self.db = database
+        self.index = index
+        self.verify = False
+
+    async def like(self, from_user_id, to_user_id):
+        if self.index.has_liked(from_user_id, to_user_id):
+            return False, False
+
+        mutual = self.index.has_liked(to_user_id, from_user_id)
+        self.index.add_like(from_user_id, to_user_id)
+        try:
+            created, mutual = await self.db.record_like(
+                from_user_id, to_user_id, None if self.verify else mutual
+            )
+        except Exception:
+            self.index.remove_like(from_user_id, to_user_id)
+            raise
+
+        if not created:
+            logger.warning(f"Лайк {from_user_id} -> {to_user_id} уже был в базе, но отсутствовал в индексе")
+            return False, False
+        return True, mutual
+
+
+likes = LikeService(db, eligibility)
@@ -0,0 +1,153 @@
+import logging
+from collections import deque
+
+from cards import cards
+from database import db
+from ranking import RankingEngine
+from seen import SeenTracker
+
+logger = logging.getLogger(__name__)
+
+CANDIDATE_BATCH_SIZE = 50
+
+GENDERS = {'мужской': 'male', 'женский': 'female'}
+SEARCH_GENDERS = {'парни': 'male', 'девушки': 'female'}
+
+
+class EligibilityIndex:
+    def __init__(self):
+        self._clear()
+
+    def _clear(self):
+        self.slots = {}
+        self.ids = []
+        self.active = 0
+        self.approved = 0
+        self.genders = {'male': 0, 'female': 0}
+        self.liked = {}
+
+    def slot(self, user_id):
+        slot = self.slots.get(user_id)
+        if slot is None:
+            slot = len(self.ids)
+            self.slots[user_id] = slot
+            self.ids.append(user_id)
+        return slot
+
+    def _set(self, bitmap, slot, value):
+        return bitmap | (1 << slot) if value else bitmap & ~(1 << slot)
+
+    async def load(self, database):
+        users = await database.get_eligibility_rows()
+        likes = await database.get_all_likes()
+
+        self._clear()
+        for user_id, is_active, is_approved, gender in users:
+            self.update_user(user_id, is_active=is_active, is_approved=is_approved, gender=gender)
+        for from_user_id, to_user_id in likes:
+            self.add_like(from_user_id, to_user_id)
+        logger.info(f"Индекс анкет загружен: {len(users)} пользователей, {len(likes)} лайков")
+
+    def update_user(self, user_id, is_active=None, is_approved=None, gender=None):
+        slot = self.slot(user_id)
+        if is_active is not None:
+            self.active = self._set(self.active, slot, is_active)
+        if is_approved is not None:
+            self.approved = self._set(self.approved, slot, is_approved)
+        if gender is not None:
+            for key in self.genders:
+                self.genders[key] = self._set(self.genders[key], slot, GENDERS.get(gender) == key)
+
+    def remove_user(self, user_id):
+        slot = self.slots.get(user_id)
+        if slot is None:
+            return
+        mask = ~(1 << slot)
+        self.active &= mask
+        self.approved &= mask
+        for key in self.genders:
+            self.genders[key] &= mask
+        self.liked.pop(user_id, None)
+        for liker_id, bitmap in self.liked.items():
+            self.liked[liker_id] = bitmap & mask
+
+    def add_like(self, from_user_id, to_user_id):
+        slot = self.slot(to_user_id)
+        self.liked[from_user_id] = self.liked.get(from_user_id, 0) | (1 << slot)
+
+    def remove_like(self, from_user_id, to_user_id):
+        slot = self.slots.get(to_user_id)
+        if slot is not None and from_user_id in self.liked:
+            self.liked[from_user_id] &= ~(1 << slot)
+
+    def has_liked(self, from_user_id, to_user_id):
+        slot = self.slots.get(to_user_id)
+        return slot is not None and bool(self.liked.get(from_user_id, 0) >> slot & 1)
+
+    def is_eligible(self, user_id, candidate_id, search_gender):
+        slot = self.slots.get(candidate_id)
+        if slot is None or candidate_id == user_id:
+            return False
+        if not (self.active >> slot & 1 and self.approved >> slot & 1):
+            return False
+        gender = SEARCH_GENDERS.get(search_gender)
+        if gender and not self.genders[gender] >> slot & 1:
+            return False
+        return not self.liked.get(user_id, 0) >> slot & 1
+
+    def eligible(self, user_id, search_gender):
+        bitmap = self.active & self.approved
+        gender = SEARCH_GENDERS.get(search_gender)
+        if gender:
+            bitmap &= self.genders[gender]
+        bitmap &= ~self.liked.get(user_id, 0)
+        slot = self.slots.get(user_id)
+        if slot is not None:
+            bitmap &= ~(1 << slot)
+        return bitmap
+
+
+class CandidateQueue:
+    def __init__(self, cards, index, ranking, seen, batch_size=CANDIDATE_BATCH_SIZE):
+        self.cards = cards
+        self.index = index
+        self.ranking = ranking
+        self.seen = seen
+        self.batch_size = batch_size
+        self._queues = {}
+
+    def reset(self, user_id):
+        self._queues.pop(user_id, None)
+
+    def _refill(self, user_id, search_gender):
+        eligible = self.index.eligible(user_id, search_gender)
+        bitmap = eligible & ~self.seen.mask(user_id)
+        if not bitmap and eligible:
+            logger.info(f"Пользователь {user_id} просмотрел все анкеты, история просмотров сброшена")
+            self.seen.reset(user_id)
+            bitmap = eligible
+        return self.ranking.top_k(user_id, bitmap, self.batch_size)
+
+    async def next_candidate(self, user_id, search_gender):
+        queue = self._queues.setdefault(user_id, deque())
+        refilled = False
+
+        while True:
+            while queue:
+                candidate_id = queue.popleft()
+                if not self.index.is_eligible(user_id, candidate_id, search_gender):
+                    continue
+                card = await self.cards.get(candidate_id, 'public')
+                if card:
+                    return card
+
+            if refilled:
+                return None
+            refilled = True
+            queue.extend(self._refill(user_id, search_gender))
+
+
+eligibility = EligibilityIndex()
+ranking = RankingEngine(eligibility)
+seen = SeenTracker(db, eligibility)
+candidates = CandidateQueue(cards, eligibility, ranking, seen)
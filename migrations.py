@@ -0,0 +1,362 @@
+import logging
+import sqlite3
+from datetime import datetime
+
+from database import DB_PATH, BUSY_TIMEOUT_MS, HOT_QUERIES
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_CHUNK_SIZE = 500
+
+INDEXES = [
+    ('idx_likes_from_to', "CREATE UNIQUE INDEX IF NOT EXISTS idx_likes_from_to ON likes (from_user_id, to_user_id)"),
+    ('idx_likes_to_liked_at', "CREATE INDEX IF NOT EXISTS idx_likes_to_liked_at ON likes (to_user_id, liked_at)"),
+    ('idx_matches_user1', "CREATE INDEX IF NOT EXISTS idx_matches_user1 ON matches (user1_id, matched_at)"),
+    ('idx_matches_user2', "CREATE INDEX IF NOT EXISTS idx_matches_user2 ON matches (user2_id, matched_at)"),
+    ('idx_reports_reporter', "CREATE INDEX IF NOT EXISTS idx_reports_reporter ON reports (reporter_id, reported_user_id, status)"),
+    ('idx_reports_status_reported_at', "CREATE INDEX IF NOT EXISTS idx_reports_status_reported_at ON reports (status, reported_at)"),
+    ('idx_users_review_registered', "CREATE INDEX IF NOT EXISTS idx_users_review_registered ON users (is_under_review, registered_at)"),
+]
+
+
+def backfill(conn, table, assignment, condition, params=(), chunk_size=BACKFILL_CHUNK_SIZE):
+    last_rowid = None
+    updated = 0
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rowids = [row[0] for row in conn.execute(
+                f"SELECT rowid FROM {table} WHERE (? IS NULL OR rowid > ?) AND ({condition}) ORDER BY rowid LIMIT ?",
+                (last_rowid, last_rowid, *params, chunk_size)
+            )]
+            if rowids:
+                cursor = conn.execute(
+                    f"UPDATE {table} SET {assignment} WHERE rowid IN ({','.join('?' * len(rowids))})",
+                    rowids
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        if not rowids:
+            return updated
+        updated += cursor.rowcount
+        last_rowid = rowids[-1]
+
+
+def _initial_schema(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            class TEXT,
+            interests TEXT,
+            about_me TEXT,
+            gender TEXT,
+            search_gender TEXT,
+            registered_at TIMESTAMP,
+            is_active BOOLEAN DEFAULT TRUE,
+            is_approved BOOLEAN DEFAULT FALSE,
+            last_match_time TIMESTAMP,
+            photo_path TEXT,
+            favorite_subject TEXT,
+            hobby TEXT,
+            dream TEXT,
+            reported_count INTEGER DEFAULT 0,
+            last_reported TIMESTAMP
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS matches (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user1_id INTEGER,
+            user2_id INTEGER,
+            matched_at TIMESTAMP,
+            status TEXT DEFAULT 'active',
+            FOREIGN KEY (user1_id) REFERENCES users (user_id),
+            FOREIGN KEY (user2_id) REFERENCES users (user_id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS likes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_user_id INTEGER,
+            to_user_id INTEGER,
+            liked_at TIMESTAMP,
+            is_notified BOOLEAN DEFAULT FALSE,
+            FOREIGN KEY (from_user_id) REFERENCES users (user_id),
+            FOREIGN KEY (to_user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            reporter_id INTEGER,
+            reported_user_id INTEGER,
+            reason TEXT,
+            reported_at TIMESTAMP,
+            status TEXT DEFAULT 'pending',
+            reviewed_by INTEGER,
+            reviewed_at TIMESTAMP,
+            FOREIGN KEY (reporter_id) REFERENCES users (user_id),
+            FOREIGN KEY (reported_user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS admin_actions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER,
+            action TEXT,
+            target_user_id INTEGER,
+            details TEXT,
+            action_at TIMESTAMP,
+            FOREIGN KEY (admin_id) REFERENCES users (user_id),
+            FOREIGN KEY (target_user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+
+def _add_is_under_review(conn):
+    columns = [col[1] for col in conn.execute("PRAGMA table_info(users)").fetchall()]
+    if 'is_under_review' not in columns:
+        conn.execute("ALTER TABLE users ADD COLUMN is_under_review BOOLEAN DEFAULT FALSE")
+        logger.info("Добавлена колонка is_under_review в таблицу users")
+
+
+def _backfill_is_under_review(conn):
+    queued = backfill(
+        conn, 'users', 'is_under_review = 1',
+        "is_active = 1 AND is_approved = 0 AND (is_under_review = 0 OR is_under_review IS NULL)"
+    )
+    cleared = backfill(conn, 'users', 'is_under_review = 0', "is_approved = 1 AND is_under_review = 1")
+    logger.info(f"Флаги модерации обновлены: на модерацию {queued}, снято {cleared}")
+
+
+def _hot_query_indexes(conn):
+    removed = conn.execute('''
+        DELETE FROM likes WHERE id NOT IN (
+            SELECT MIN(id) FROM likes GROUP BY from_user_id, to_user_id
+        )
+    ''').rowcount
+    if removed:
+        logger.info(f"Удалено повторных лайков: {removed}")
+
+    for _, sql in INDEXES:
+        conn.execute(sql)
+    conn.execute("ANALYZE")
+
+
+def _seen_profiles(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS seen_profiles (
+            user_id INTEGER PRIMARY KEY,
+            bloom BLOB,
+            seen_count INTEGER DEFAULT 0,
+            updated_at TIMESTAMP,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+    ''')
+
+
+def _add_photo_file_id(conn):
+    columns = [col[1] for col in conn.execute("PRAGMA table_info(users)").fetchall()]
+    if 'photo_file_id' not in columns:
+        conn.execute("ALTER TABLE users ADD COLUMN photo_file_id TEXT")
+
+
+def _photos(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS photos (
+            hash TEXT PRIMARY KEY,
+            path TEXT,
+            thumb_path TEXT,
+            width INTEGER,
+            height INTEGER,
+            size INTEGER,
+            created_at TIMESTAMP
+        )
+    ''')
+    columns = [col[1] for col in conn.execute("PRAGMA table_info(users)").fetchall()]
+    if 'photo_hash' not in columns:
+        conn.execute("ALTER TABLE users ADD COLUMN photo_hash TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_photo_hash ON users (photo_hash)")
+
+
+def _add_photo_phash(conn):
+    columns = [col[1] for col in conn.execute("PRAGMA table_info(photos)").fetchall()]
+    if 'phash' not in columns:
+        conn.execute("ALTER TABLE photos ADD COLUMN phash INTEGER")
+
+
+def _pagination_indexes(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_likes_from_liked_at ON likes (from_user_id, liked_at)")
+    conn.execute("ANALYZE")
+
+
+def _outbox(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER,
+            text TEXT,
+            reply_markup TEXT,
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at REAL,
+            status TEXT DEFAULT 'pending',
+            last_error TEXT,
+            created_at TIMESTAMP
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_outbox_status_next ON outbox (status, next_attempt_at)")
+
+
+def _broadcasts(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER,
+            text TEXT,
+            status TEXT DEFAULT 'running',
+            last_user_id INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            total INTEGER DEFAULT 0,
+            status_chat_id INTEGER,
+            status_message_id INTEGER,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    ''')
+
+
+def _user_state(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_state (
+            user_id INTEGER,
+            key TEXT,
+            value TEXT,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (user_id, key)
+        ) WITHOUT ROWID
+    ''')
+
+
+SHARD_CHANGE_TRIGGERS = {
+    'users_insert': "AFTER INSERT ON users BEGIN INSERT INTO shard_changes (kind, subject) VALUES ('user', NEW.user_id); END",
+    'users_update': (
+        "AFTER UPDATE OF username, first_name, last_name, class, interests, about_me, gender, search_gender, "
+        "favorite_subject, hobby, dream, is_active, is_approved, photo_path, photo_file_id, photo_hash ON users "
+        "BEGIN INSERT INTO shard_changes (kind, subject) VALUES ('user', NEW.user_id); END"
+    ),
+    'users_delete': "AFTER DELETE ON users BEGIN INSERT INTO shard_changes (kind, subject) VALUES ('user', OLD.user_id); END",
+    'likes_insert': (
+        "AFTER INSERT ON likes BEGIN "
+        "INSERT INTO shard_changes (kind, subject, object) VALUES ('like', NEW.from_user_id, NEW.to_user_id); END"
+    ),
+    'likes_delete': (
+        "AFTER DELETE ON likes BEGIN "
+        "INSERT INTO shard_changes (kind, subject, object) VALUES ('unlike', OLD.from_user_id, OLD.to_user_id); END"
+    ),
+    'photos_insert': "AFTER INSERT ON photos BEGIN INSERT INTO shard_changes (kind, subject) VALUES ('photo', NEW.hash); END",
+    'photos_update': "AFTER UPDATE OF phash ON photos BEGIN INSERT INTO shard_changes (kind, subject) VALUES ('photo', NEW.hash); END",
+    'photos_delete': "AFTER DELETE ON photos BEGIN INSERT INTO shard_changes (kind, subject) VALUES ('photo', OLD.hash); END",
+}
+
+
+def _shard_changes(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS shard_changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT,
+            subject,
+            object,
+            changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    for name, body in SHARD_CHANGE_TRIGGERS.items():
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_shard_changes_{name} {body}")
+
+
+MIGRATIONS = [
+    (1, 'initial_schema', _initial_schema, True),
+    (2, 'users_is_under_review', _add_is_under_review, True),
+    (3, 'backfill_is_under_review', _backfill_is_under_review, False),
+    (4, 'hot_query_indexes', _hot_query_indexes, True),
+    (5, 'seen_profiles', _seen_profiles, True),
+    (6, 'users_photo_file_id', _add_photo_file_id, True),
+    (7, 'photos', _photos, True),
+    (8, 'photos_phash', _add_photo_phash, True),
+    (9, 'pagination_indexes', _pagination_indexes, True),
+    (10, 'outbox', _outbox, True),
+    (11, 'broadcasts', _broadcasts, True),
+    (12, 'user_state', _user_state, True),
+    (13, 'shard_changes', _shard_changes, True),
+]
+
+
+def get_schema_version(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT,
+            applied_at TIMESTAMP
+        )
+    ''')
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def run_migrations(path=DB_PATH):
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        conn.execute("PRAGMA journal_mode = WAL")
+        current = get_schema_version(conn)
+
+        for version, name, migrate, transactional in MIGRATIONS:
+            if version <= current:
+                continue
+
+            logger.info(f"Применяется миграция {version}: {name}")
+            if transactional:
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    migrate(conn)
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+            else:
+                migrate(conn)
+                conn.execute("BEGIN IMMEDIATE")
+
+            conn.execute(
+                "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                (version, name, datetime.now())
+            )
+            conn.execute("COMMIT")
+            current = version
+
+        logger.info(f"Схема базы данных актуальна (версия {current})")
+        return current
+    finally:
+        conn.close()
+
+
+def check_query_plans(path=DB_PATH):
+    conn = sqlite3.connect(path)
+    problems = []
+    try:
+        for name, (sql, index) in HOT_QUERIES.items():
+            params = (0,) * sql.count('?')
+            plan = ' | '.join(row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+            if index not in plan:
+                problems.append(name)
+                logger.warning(f"Запрос {name} не использует индекс {index}: {plan}")
+    finally:
+        conn.close()
+    return problems
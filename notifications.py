@@ -0,0 +1,199 @@
+import asyncio
+import logging
+import time
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from database import db
+from outbox import outbox
+
+logger = logging.getLogger(__name__)
+
+ADMIN_DIGEST_WINDOW = 60.0
+DIGEST_PREVIEW = 5
+DIGEST_REASON_LENGTH = 100
+LIKE_QUIET_PERIOD = 60.0
+LIKE_MAX_DELAY = 600.0
+LIKE_CHECK_INTERVAL = 5.0
+
+
+def plural(count, one, few, many):
+    if count % 10 == 1 and count % 100 != 11:
+        return one
+    if 2 <= count % 10 <= 4 and not 12 <= count % 100 <= 14:
+        return few
+    return many
+
+
+class AdminDigest:
+    def __init__(self, database, sender, window=ADMIN_DIGEST_WINDOW):
+        self.db = database
+        self.sender = sender
+        self.window = window
+        self.admin_ids = []
+        self.profiles = []
+        self.reports = []
+        self._flusher = None
+
+    async def start(self, admin_ids):
+        self.admin_ids = list(admin_ids)
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    def add_profile(self, user_id, name, class_name):
+        self.profiles.append((user_id, name, class_name))
+
+    def add_report(self, reported_user_id, name, reason):
+        self.reports.append((reported_user_id, name, reason))
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.window)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка при отправке сводки администраторам: {e}")
+
+    def render(self, profiles, reports, counts):
+        lines = ["📬 Сводка для модераторов"]
+
+        if profiles:
+            lines += ["", f"📋 Новых анкет: {len(profiles)}"]
+            lines += [f"• {name}, {class_name} (ID: {user_id})" for user_id, name, class_name in profiles[:DIGEST_PREVIEW]]
+            if len(profiles) > DIGEST_PREVIEW:
+                lines.append(f"…и ещё {len(profiles) - DIGEST_PREVIEW}")
+
+        if reports:
+            lines += ["", f"🚨 Новых жалоб: {len(reports)}"]
+            for user_id, name, reason in reports[:DIGEST_PREVIEW]:
+                if len(reason) > DIGEST_REASON_LENGTH:
+                    reason = reason[:DIGEST_REASON_LENGTH] + "…"
+                lines.append(f"• {name} (ID: {user_id}): {reason}")
+            if len(reports) > DIGEST_PREVIEW:
+                lines.append(f"…и ещё {len(reports) - DIGEST_PREVIEW}")
+
+        if counts:
+            lines += [
+                "",
+                f"Всего на модерации: {counts[0]} анкет, {counts[1]} жалоб",
+            ]
+        return "\n".join(lines)
+
+    async def flush(self):
+        if not self.profiles and not self.reports:
+            return
+        profiles, self.profiles = self.profiles, []
+        reports, self.reports = self.reports, []
+
+        try:
+            counts = await self.db.get_moderation_counts()
+        except Exception as e:
+            logger.error(f"Ошибка при получении статистики модерации: {e}")
+            counts = None
+
+        text = self.render(profiles, reports, counts)
+        reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("🛠️ Панель модерации", callback_data="moderation_panel")]])
+        for admin_id in self.admin_ids:
+            try:
+                await self.sender.send(admin_id, text, reply_markup=reply_markup)
+            except Exception as e:
+                logger.error(f"Ошибка при отправке сводки администратору {admin_id}: {e}")
+
+
+class LikeNotifier:
+    def __init__(self, sender, quiet=LIKE_QUIET_PERIOD, max_delay=LIKE_MAX_DELAY):
+        self.sender = sender
+        self.quiet = quiet
+        self.max_delay = max_delay
+        self.pending = {}
+        self._flusher = None
+
+    async def start(self):
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush(force=True)
+
+    def add(self, user_id, liker_id):
+        now = time.monotonic()
+        entry = self.pending.get(user_id)
+        if entry is None:
+            self.pending[user_id] = [{liker_id: None}, now, now]
+        else:
+            entry[0][liker_id] = None
+            entry[2] = now
+
+    def discard(self, user_id, liker_id):
+        entry = self.pending.get(user_id)
+        if entry is not None:
+            entry[0].pop(liker_id, None)
+            if not entry[0]:
+                del self.pending[user_id]
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(min(LIKE_CHECK_INTERVAL, self.quiet))
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка при отправке уведомлений о лайках: {e}")
+
+    def render(self, likers):
+        if len(likers) == 1:
+            text = (
+                "💖 Твоя анкета кому-то понравилась!\n\n"
+                "Кто-то поставил лайк твоей анкете. "
+                "Если поставишь взаимный лайк - узнаешь кто это! 😊"
+            )
+            keyboard = [
+                [InlineKeyboardButton("👀 Посмотреть анкету", callback_data=f"view_anonymous_{likers[0]}")],
+                [InlineKeyboardButton("💝 Мои лайки", callback_data="my_likes")]
+            ]
+        else:
+            count = len(likers)
+            text = (
+                f"💖 Твоей анкете поставили {count} {plural(count, 'новый лайк', 'новых лайка', 'новых лайков')}!\n\n"
+                "Загляни в «Мои лайки» и поставь взаимный лайк тем, кто тебе понравится - "
+                "так ты узнаешь, кто это! 😊"
+            )
+            keyboard = [[InlineKeyboardButton("💝 Мои лайки", callback_data="my_likes")]]
+        return text, InlineKeyboardMarkup(keyboard)
+
+    async def flush(self, force=False):
+        now = time.monotonic()
+        due = [
+            user_id for user_id, (likers, first, last) in self.pending.items()
+            if force or now - last >= self.quiet or now - first >= self.max_delay
+        ]
+        for user_id in due:
+            entry = self.pending.pop(user_id, None)
+            if entry is None:
+                continue
+            likers = list(entry[0])
+            text, reply_markup = self.render(likers)
+            try:
+                await self.sender.send(user_id, text, reply_markup=reply_markup)
+            except Exception as e:
+                logger.error(f"Ошибка при отправке уведомления пользователю {user_id}: {e}")
+
+
+admin_digest = AdminDigest(db, outbox)
+like_notifier = LikeNotifier(outbox)
@@ -0,0 +1,207 @@
+import asyncio
+import json
+import logging
+import time
+
+from telegram import InlineKeyboardMarkup
+from telegram.error import BadRequest, Forbidden, RetryAfter, TelegramError
+
+from database import db
+from sharding import shard
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_WORKERS = 4
+OUTBOX_POLL_INTERVAL = 1.0
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_BACKOFF_BASE = 2.0
+OUTBOX_BACKOFF_MAX = 300.0
+GLOBAL_RATE = 25.0
+GLOBAL_BURST = 25.0
+CHAT_RATE = 1.0
+CHAT_BURST = 3.0
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class Outbox:
+    def __init__(self, database, workers=OUTBOX_WORKERS):
+        self.db = database
+        self.workers = workers
+        self.bot = None
+        self.global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_BURST)
+        self.sent = 0
+        self.failed = 0
+        self._chat_buckets = {}
+        self._chat_locks = {}
+        self._paused_until = 0.0
+        self._queue = None
+        self._inflight = set()
+        self._finished = set()
+        self._tasks = []
+
+    async def start(self, bot):
+        if self._tasks:
+            return
+        self.bot = bot
+        if shard.sharded:
+            self.global_bucket = TokenBucket(GLOBAL_RATE / shard.count, GLOBAL_BURST / shard.count)
+        self._queue = asyncio.Queue()
+        self._tasks = [asyncio.create_task(self._poll_loop())]
+        self._tasks += [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    @property
+    def depth(self):
+        return len(self._inflight)
+
+    async def send(self, chat_id, text, reply_markup=None):
+        markup = reply_markup.to_json() if reply_markup is not None else None
+        message_id = await self.db.add_outbox_message(chat_id, text, markup)
+        if self._queue is not None and shard.owns(chat_id):
+            self._inflight.add(message_id)
+            self._queue.put_nowait((message_id, chat_id, text, markup, 0))
+        return message_id
+
+    async def _poll_loop(self):
+        while True:
+            if self._queue.qsize() < OUTBOX_BATCH_SIZE:
+                self._finished = set()
+                try:
+                    rows = await self.db.get_due_outbox_messages(
+                        time.time(), OUTBOX_BATCH_SIZE + len(self._inflight), shard.index, shard.count
+                    )
+                except Exception as e:
+                    logger.error(f"Ошибка при чтении очереди сообщений: {e}")
+                    rows = []
+            else:
+                rows = []
+
+            for row in rows:
+                if row[0] not in self._inflight and row[0] not in self._finished:
+                    self._inflight.add(row[0])
+                    self._queue.put_nowait(row)
+
+            now = time.monotonic()
+            for chat_id in [chat_id for chat_id, bucket in self._chat_buckets.items() if bucket.idle(now)]:
+                lock = self._chat_locks.get(chat_id)
+                if lock is None or not lock.locked():
+                    self._chat_buckets.pop(chat_id, None)
+                    self._chat_locks.pop(chat_id, None)
+
+            await asyncio.sleep(OUTBOX_POLL_INTERVAL)
+
+    async def _worker(self):
+        while True:
+            item = await self._queue.get()
+            try:
+                await self._deliver(*item)
+            except Exception as e:
+                logger.error(f"Ошибка при отправке сообщения {item[0]}: {e}")
+            finally:
+                self._inflight.discard(item[0])
+                self._finished.add(item[0])
+
+    async def _acquire(self, chat_id, extra=None):
+        buckets = [self.global_bucket, self._chat_buckets.setdefault(chat_id, TokenBucket(CHAT_RATE, CHAT_BURST))]
+        if extra is not None:
+            buckets.append(extra)
+        while True:
+            now = time.monotonic()
+            wait = max([self._paused_until - now] + [bucket.delay(now) for bucket in buckets])
+            if wait <= 0:
+                for bucket in buckets:
+                    bucket.take(now)
+                return
+            await asyncio.sleep(wait)
+
+    def _pause(self, e):
+        retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+        self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+        logger.warning(f"Telegram ограничил отправку, пауза {retry_after} с")
+        return retry_after
+
+    async def send_now(self, chat_id, text, reply_markup=None, bucket=None):
+        attempts = 0
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        async with lock:
+            while True:
+                await self._acquire(chat_id, bucket)
+                try:
+                    await self.bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+                except RetryAfter as e:
+                    self._pause(e)
+                    continue
+                except (Forbidden, BadRequest) as e:
+                    logger.warning(f"Сообщение для {chat_id} не доставлено: {e}")
+                    return False
+                except TelegramError as e:
+                    attempts += 1
+                    if attempts >= OUTBOX_MAX_ATTEMPTS:
+                        logger.error(f"Сообщение для {chat_id} не доставлено после {attempts} попыток: {e}")
+                        return False
+                    await asyncio.sleep(min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE ** attempts))
+                    continue
+                self.sent += 1
+                return True
+
+    async def _deliver(self, message_id, chat_id, text, markup, attempts):
+        reply_markup = InlineKeyboardMarkup.de_json(json.loads(markup), self.bot) if markup else None
+        lock = self._chat_locks.setdefault(chat_id, asyncio.Lock())
+        async with lock:
+            await self._acquire(chat_id)
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+            except RetryAfter as e:
+                retry_after = self._pause(e)
+                await self.db.reschedule_outbox_message(message_id, attempts, time.time() + retry_after, str(e))
+                return
+            except (Forbidden, BadRequest) as e:
+                self.failed += 1
+                logger.warning(f"Сообщение для {chat_id} не доставлено: {e}")
+                await self.db.fail_outbox_message(message_id, str(e))
+                return
+            except TelegramError as e:
+                attempts += 1
+                if attempts >= OUTBOX_MAX_ATTEMPTS:
+                    self.failed += 1
+                    logger.error(f"Сообщение для {chat_id} не доставлено после {attempts} попыток: {e}")
+                    await self.db.fail_outbox_message(message_id, str(e))
+                else:
+                    delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE ** attempts)
+                    await self.db.reschedule_outbox_message(message_id, attempts, time.time() + delay, str(e))
+                return
+
+        self.sent += 1
+        await self.db.delete_outbox_message(message_id)
+
+
+outbox = Outbox(db)
@@ -0,0 +1,300 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageOps
+from scipy.fft import dct
+
+logger = logging.getLogger(__name__)
+
+PHOTOS_DIR = "user_photos"
+INCOMING_DIR = os.path.join(PHOTOS_DIR, "incoming")
+MAX_PHOTO_BYTES = 10 * 1024 * 1024
+HASH_CHUNK_SIZE = 64 * 1024
+PHOTO_WORKERS = 2
+PHOTO_QUEUE_SIZE = 8
+PHASH_SAMPLE_SIZE = 32
+PHASH_LOW_FREQUENCIES = 8
+PHASH_MAX_DISTANCE = 8
+PHASH_MASK = (1 << 64) - 1
+CARD_SIZE = (1280, 1280)
+JPEG_QUALITY = 85
+
+
+class PhotoError(Exception):
+    pass
+
+
+class PhotoQueueFull(Exception):
+    pass
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def photo_paths(digest):
+    directory = os.path.join(PHOTOS_DIR, digest[:2])
+    return os.path.join(directory, f"{digest}.jpg"), os.path.join(directory, f"{digest}_thumb.jpg")
+
+
+def incoming_path(user_id, message_id):
+    return os.path.join(INCOMING_DIR, f"{user_id}_{message_id}.part")
+
+
+def perceptual_hash(image):
+    gray = image.convert('L').resize((PHASH_SAMPLE_SIZE, PHASH_SAMPLE_SIZE), Image.LANCZOS)
+    pixels = np.asarray(gray, dtype=np.float64)
+    coeffs = dct(dct(pixels, axis=0, norm='ortho'), axis=1, norm='ortho')
+    low = coeffs[:PHASH_LOW_FREQUENCIES, :PHASH_LOW_FREQUENCIES].ravel()
+    bits = low > np.median(low[1:])
+    return int(np.packbits(bits).view('>i8')[0])
+
+
+def file_phash(path):
+    with Image.open(path) as image:
+        return perceptual_hash(image)
+
+
+def hamming(a, b):
+    return ((a ^ b) & PHASH_MASK).bit_count()
+
+
+def _save_jpeg(image, path):
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    image.save(tmp_path, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+    os.replace(tmp_path, path)
+
+
+def process_photo(source_path):
+    try:
+        if os.path.getsize(source_path) > MAX_PHOTO_BYTES:
+            raise PhotoError("Фото слишком большое")
+
+        digest = file_digest(source_path)
+        card_path = photo_paths(digest)[0]
+        if os.path.exists(card_path):
+            with Image.open(card_path) as card:
+                width, height = card.size
+                phash = perceptual_hash(card)
+            return digest, card_path, width, height, os.path.getsize(card_path), phash
+
+        try:
+            with Image.open(source_path) as image:
+                image = ImageOps.exif_transpose(image).convert('RGB')
+        except (OSError, Image.DecompressionBombError) as e:
+            raise PhotoError(f"Не удалось прочитать изображение: {e}")
+
+        os.makedirs(os.path.dirname(card_path), exist_ok=True)
+        image.thumbnail(CARD_SIZE)
+        _save_jpeg(image, card_path)
+        width, height = image.size
+        phash = perceptual_hash(image)
+
+        return digest, card_path, width, height, os.path.getsize(card_path), phash
+    finally:
+        try:
+            os.remove(source_path)
+        except FileNotFoundError:
+            pass
+
+
+class PhotoPipeline:
+    def __init__(self, workers=PHOTO_WORKERS, queue_size=PHOTO_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.pending = 0
+        self._executor = None
+
+    def start(self):
+        if self._executor is None:
+            os.makedirs(INCOMING_DIR, exist_ok=True)
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+            )
+
+    async def stop(self):
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.to_thread(executor.shutdown, True, cancel_futures=True)
+
+    @property
+    def full(self):
+        return self.pending >= self.queue_size
+
+    def reserve(self):
+        if self.full:
+            raise PhotoQueueFull()
+        self.pending += 1
+
+    def release(self):
+        self.pending -= 1
+
+    async def run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def process(self, source_path):
+        return await self.run(process_photo, source_path)
+
+
+class BKTree:
+    def __init__(self):
+        self.root = None
+
+    def add(self, value, key):
+        if self.root is None:
+            self.root = [value, {key}, {}]
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].add(key)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, {key}, {}]
+                return
+            node = child
+
+    def discard(self, value, key):
+        node = self.root
+        while node is not None:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].discard(key)
+                return
+            node = node[2].get(distance)
+
+    def search(self, value, radius):
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                found.extend((key, distance) for key in node[1])
+            for edge, child in node[2].items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return found
+
+
+class DuplicateIndex:
+    def __init__(self):
+        self.tree = BKTree()
+        self.phashes = {}
+
+    async def load(self, database):
+        self.tree = BKTree()
+        self.phashes = {}
+        for digest, phash in await database.get_photo_phashes():
+            self.add(digest, phash)
+        logger.info(f"Индекс похожих фото загружен: {len(self.phashes)} фото")
+
+    async def backfill(self, database, pipeline):
+        for digest, path in await database.get_photos_without_phash():
+            try:
+                phash = await pipeline.run(file_phash, path)
+            except Exception as e:
+                logger.error(f"Не удалось посчитать перцептивный хеш фото {digest}: {e}")
+                continue
+            await database.set_photo_phash(digest, phash)
+            self.add(digest, phash)
+
+    def add(self, digest, phash):
+        if phash is None or digest in self.phashes:
+            return
+        self.phashes[digest] = phash
+        self.tree.add(phash, digest)
+
+    def remove(self, digest):
+        phash = self.phashes.pop(digest, None)
+        if phash is not None:
+            self.tree.discard(phash, digest)
+
+    def similar(self, digest, radius=PHASH_MAX_DISTANCE):
+        phash = self.phashes.get(digest)
+        if phash is None:
+            return [(digest, 0)] if digest else []
+        return sorted(self.tree.search(phash, radius), key=lambda item: item[1])
+
+
+async def store_photo(database, pipeline, source_path):
+    photo = await pipeline.process(source_path)
+    await database.add_photo(*photo)
+    photo_index.add(photo[0], photo[5])
+    return photo
+
+
+def _remove_files(*paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+async def release_photo(database, photo_path, digest):
+    try:
+        if digest:
+            if await database.delete_unused_photo(digest):
+                photo_index.remove(digest)
+                await asyncio.to_thread(_remove_files, *photo_paths(digest))
+        elif photo_path:
+            await asyncio.to_thread(_remove_files, photo_path)
+    except Exception as e:
+        logger.error(f"Ошибка при удалении фото: {e}")
+
+
+def write_photo(path, data):
+    with open(path, 'wb') as target:
+        target.write(data)
+
+
+async def save_incoming(path, data):
+    await asyncio.to_thread(write_photo, path, data)
+
+
+async def discard_incoming(path):
+    await asyncio.to_thread(_remove_files, path)
+
+
+def read_photo(path):
+    with open(path, 'rb') as photo:
+        return photo.read()
+
+
+async def load_photo(path, file_id):
+    if file_id:
+        return file_id
+    if not path:
+        return None
+    try:
+        return await asyncio.to_thread(read_photo, path)
+    except OSError as e:
+        logger.error(f"Не удалось прочитать фото {path}: {e}")
+        return None
+
+
+async def remember_file_id(database, user_id, photo, message):
+    if not isinstance(photo, bytes) or not getattr(message, 'photo', None):
+        return False
+    try:
+        return await database.set_photo_file_id(user_id, message.photo[-1].file_id) > 0
+    except Exception as e:
+        logger.error(f"Ошибка при сохранении file_id фото пользователя {user_id}: {e}")
+        return False
+
+
+photo_pipeline = PhotoPipeline()
+photo_index = DuplicateIndex()
@@ -0,0 +1,200 @@
+import asyncio
+import logging
+import re
+from collections import Counter
+
+import numpy as np
+from scipy import sparse
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r"\w+")
+MIN_TOKEN_LENGTH = 3
+STEM_LENGTH = 6
+RANKING_REBUILD_MIN = 64
+RANKING_REBUILD_RATIO = 0.05
+STOP_WORDS = {
+    'для', 'или', 'как', 'что', 'это', 'все', 'всё', 'еще', 'ещё', 'очень', 'люблю',
+    'нравится', 'также', 'тоже', 'когда', 'меня', 'мне', 'мой', 'моя', 'мои', 'свой',
+}
+
+
+def tokenize(*texts):
+    tokens = []
+    for text in texts:
+        if not text:
+            continue
+        for word in TOKEN_RE.findall(text.lower().replace('ё', 'е')):
+            if len(word) < MIN_TOKEN_LENGTH or word.isdigit() or word in STOP_WORDS:
+                continue
+            tokens.append(word[:STEM_LENGTH])
+    return tokens
+
+
+def bitmap_to_mask(bitmap, size):
+    raw = np.frombuffer(bitmap.to_bytes((size + 7) // 8, 'little'), dtype=np.uint8)
+    return np.unpackbits(raw, bitorder='little')[:size].astype(bool)
+
+
+def idf_weights(df, rows):
+    return np.log((1 + rows) / (1 + df)) + 1
+
+
+def build_matrix(rows, df, size, terms):
+    slots = list(rows)
+    lengths = [len(rows[slot][0]) for slot in slots]
+
+    row_index = np.repeat(np.array(slots, dtype=np.int64), lengths)
+    columns = np.concatenate([rows[slot][0] for slot in slots]) if slots else np.zeros(0, dtype=np.int64)
+    values = np.concatenate([rows[slot][1] for slot in slots]) if slots else np.zeros(0)
+    tf = sparse.csr_matrix((values, (row_index, columns)), shape=(size, terms))
+
+    weighted = tf @ sparse.diags(idf_weights(df[:terms], len(rows)))
+    norms = np.sqrt(np.asarray(weighted.multiply(weighted).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return (sparse.diags(1 / norms) @ weighted).tocsr()
+
+
+class RankingEngine:
+    def __init__(self, index):
+        self.index = index
+        self.vocabulary = {}
+        self.rows = {}
+        self.df = np.zeros(0)
+        self.rebuilds = 0
+        self._generation = 0
+        self._base = None
+        self._overlay = {}
+        self._rebuild = None
+
+    def _term(self, token):
+        column = self.vocabulary.get(token)
+        if column is None:
+            column = len(self.vocabulary)
+            self.vocabulary[token] = column
+            if column >= len(self.df):
+                self.df = np.concatenate([self.df, np.zeros(max(64, len(self.df)))])
+        return column
+
+    async def load(self, database):
+        profiles = await database.get_ranking_texts()
+        self.vocabulary = {}
+        self.rows = {}
+        self.df = np.zeros(0)
+        self._generation += 1
+        self._base = None
+        self._overlay = {}
+        for user_id, interests, hobby, favorite_subject in profiles:
+            self.update_profile(user_id, interests, hobby, favorite_subject)
+        await self.rebuild()
+        logger.info(f"Индекс интересов загружен: {len(self.rows)} анкет, {len(self.vocabulary)} терминов")
+
+    async def refresh(self, database, user_id):
+        row = await database.get_ranking_texts(user_id)
+        if row:
+            self.update_profile(*row)
+
+    def has_profile(self, user_id):
+        slot = self.index.slots.get(user_id)
+        return slot is not None and bool(self.index.approved >> slot & 1)
+
+    def update_profile(self, user_id, interests, hobby, favorite_subject):
+        slot = self.index.slot(user_id)
+        self._drop_row(slot)
+
+        counts = Counter(tokenize(interests, hobby, favorite_subject))
+        if counts:
+            columns = np.array([self._term(token) for token in counts], dtype=np.int64)
+            values = np.array(list(counts.values()), dtype=np.float64)
+            self.rows[slot] = (columns, values)
+            self.df[columns] += 1
+        self._touch(slot)
+
+    def remove_profile(self, user_id):
+        slot = self.index.slots.get(user_id)
+        if slot is not None:
+            self._drop_row(slot)
+            self._touch(slot)
+
+    def _drop_row(self, slot):
+        row = self.rows.pop(slot, None)
+        if row is not None:
+            self.df[row[0]] -= 1
+
+    def _vector(self, slot):
+        row = self.rows.get(slot)
+        if row is None:
+            return None
+        columns, values = row
+        weights = values * idf_weights(self.df[columns], len(self.rows))
+        return columns, weights / (np.sqrt((weights ** 2).sum()) or 1)
+
+    def _touch(self, slot):
+        if self._base is None:
+            return
+        self._overlay[slot] = self._vector(slot)
+        if len(self._overlay) >= max(RANKING_REBUILD_MIN, RANKING_REBUILD_RATIO * len(self.rows)):
+            self._schedule_rebuild()
+
+    def _schedule_rebuild(self):
+        if self._rebuild is not None and not self._rebuild.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self._rebuild = loop.create_task(self.rebuild())
+
+    async def rebuild(self):
+        generation = self._generation
+        overlay = dict(self._overlay)
+        base = await asyncio.to_thread(
+            build_matrix, dict(self.rows), self.df.copy(), len(self.index.ids), len(self.vocabulary)
+        )
+        if generation != self._generation:
+            return
+        self._base = base
+        for slot, vector in overlay.items():
+            if slot in self._overlay and self._overlay[slot] is vector:
+                del self._overlay[slot]
+        self.rebuilds += 1
+
+    def _query(self, slot, base):
+        if slot in self._overlay:
+            return self._overlay[slot]
+        if slot is None or slot >= base.shape[0] or slot not in self.rows:
+            return None
+        row = base[slot]
+        return row.indices, row.data
+
+    def top_k(self, user_id, bitmap, k):
+        size = len(self.index.ids)
+        mask = bitmap_to_mask(bitmap, size)
+        count = min(k, int(mask.sum()))
+        if not count:
+            return []
+
+        base = self._base
+        if base is None:
+            base = self._base = build_matrix(self.rows, self.df, size, len(self.vocabulary))
+            self._overlay = {}
+
+        scores = np.random.random(size) * 1e-6
+        query = self._query(self.index.slots.get(user_id), base)
+        if query is not None:
+            dense = np.zeros(max(len(self.vocabulary), base.shape[1]))
+            dense[query[0]] = query[1]
+            base_scores = base @ dense[:base.shape[1]]
+            scores[:base.shape[0]] += base_scores
+            for slot, vector in self._overlay.items():
+                if slot >= size:
+                    continue
+                if slot < base.shape[0]:
+                    scores[slot] -= base_scores[slot]
+                if vector is not None:
+                    scores[slot] += vector[1] @ dense[vector[0]]
+        scores[~mask] = -np.inf
+
+        top = np.argpartition(-scores, count - 1)[:count]
+        top = top[np.argsort(-scores[top])]
+        return [self.index.ids[slot] for slot in top]
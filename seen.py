@@ -0,0 +1,143 @@
+import asyncio
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BLOOM_BITS = 8192
+BLOOM_HASHES = 4
+BLOOM_CAPACITY = 600
+SEEN_FLUSH_INTERVAL = 5.0
+
+SEEDS = np.array([0x9E3779B97F4A7C15 * (i + 1) & 0xFFFFFFFFFFFFFFFF for i in range(BLOOM_HASHES)], dtype=np.uint64)
+
+
+def bloom_positions(user_ids):
+    z = np.asarray(user_ids, dtype=np.int64).astype(np.uint64)[:, None] + SEEDS[None, :]
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    z = z ^ (z >> np.uint64(31))
+    return (z % np.uint64(BLOOM_BITS)).astype(np.int64)
+
+
+def empty_filter():
+    return np.zeros((2, BLOOM_BITS // 8), dtype=np.uint8)
+
+
+class SeenTracker:
+    def __init__(self, database, index):
+        self.db = database
+        self.index = index
+        self.filters = {}
+        self.counts = {}
+        self._positions = np.zeros((0, BLOOM_HASHES), dtype=np.int64)
+        self._masks = {}
+        self._dirty = set()
+        self._flusher = None
+
+    async def load(self):
+        rows = await self.db.get_seen_filters()
+        self.filters = {}
+        self.counts = {}
+        self._masks = {}
+        for user_id, bloom, seen_count in rows:
+            bits = np.frombuffer(bloom, dtype=np.uint8)
+            if bits.size != 2 * BLOOM_BITS // 8:
+                continue
+            self.filters[user_id] = bits.reshape(2, -1).copy()
+            self.counts[user_id] = seen_count
+        logger.info(f"Фильтры просмотренных анкет загружены: {len(self.filters)}")
+
+    async def start(self):
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(SEEN_FLUSH_INTERVAL)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Ошибка при сохранении просмотренных анкет: {e}")
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        rows = [
+            (user_id, self.filters[user_id].tobytes(), self.counts.get(user_id, 0))
+            for user_id in dirty if user_id in self.filters
+        ]
+        removed = [user_id for user_id in dirty if user_id not in self.filters]
+        try:
+            await self.db.save_seen_filters(rows, removed)
+        except Exception:
+            self._dirty |= dirty
+            raise
+
+    def _slot_positions(self):
+        size = len(self.index.ids)
+        known = self._positions.shape[0]
+        if known < size:
+            self._positions = np.concatenate([self._positions, bloom_positions(self.index.ids[known:size])])
+        return self._positions[:size]
+
+    def reindex(self):
+        self._positions = np.zeros((0, BLOOM_HASHES), dtype=np.int64)
+        self._masks = {}
+
+    def mask(self, user_id):
+        bits = self.filters.get(user_id)
+        if bits is None:
+            return 0
+
+        size = len(self.index.ids)
+        cached = self._masks.get(user_id)
+        if cached and cached[0] == size:
+            return cached[1]
+
+        positions = self._slot_positions()
+        merged = bits[0] | bits[1]
+        hits = (merged[positions >> 3] >> (positions & 7) & 1).all(axis=1)
+        bitmap = int.from_bytes(np.packbits(hits, bitorder='little').tobytes(), 'little')
+        self._masks[user_id] = (size, bitmap)
+        return bitmap
+
+    def mark(self, user_id, candidate_id):
+        bits = self.filters.get(user_id)
+        if bits is None:
+            bits = self.filters[user_id] = empty_filter()
+            self.counts[user_id] = 0
+
+        if self.counts[user_id] >= BLOOM_CAPACITY:
+            bits[1] = bits[0]
+            bits[0] = 0
+            self.counts[user_id] = 0
+            self._masks.pop(user_id, None)
+
+        positions = bloom_positions([candidate_id])[0]
+        np.bitwise_or.at(bits[0], positions >> 3, (1 << (positions & 7)).astype(np.uint8))
+        self.counts[user_id] += 1
+        self._dirty.add(user_id)
+
+        cached = self._masks.get(user_id)
+        slot = self.index.slots.get(candidate_id)
+        if cached and slot is not None:
+            self._masks[user_id] = (cached[0], cached[1] | 1 << slot)
+
+    def reset(self, user_id):
+        if self.filters.pop(user_id, None) is not None:
+            self.counts.pop(user_id, None)
+            self._masks.pop(user_id, None)
+            self._dirty.add(user_id)
@@ -0,0 +1,342 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import struct
+import time
+from collections import OrderedDict
+
+from telegram import Update
+from telegram.error import RetryAfter, TelegramError, TimedOut
+
+from dispatcher import update_key
+from webhook import WebhookIngress
+
+logger = logging.getLogger(__name__)
+
+SHARD_SOCKET_DIR = "shards"
+SHARD_REFRESH_INTERVAL = 2.0
+SHARD_CHANGES_BATCH = 1000
+SHARD_CHANGES_RETENTION = 3600.0
+SHARD_PRUNE_INTERVAL = 600.0
+SHARD_CONNECT_TIMEOUT = 60.0
+SHARD_BUFFER_LIMIT = 1024 * 1024
+SHARD_SUPERVISE_INTERVAL = 5.0
+SHARD_STOP_TIMEOUT = 30.0
+SHARD_UNACKED_LIMIT = 10000
+POLL_TIMEOUT = 30
+POLL_BACKOFF_MAX = 30.0
+FRAME_HEADER = struct.Struct('>I')
+ACK = struct.Struct('>q')
+
+
+class ShardInfo:
+    def __init__(self):
+        self.index = 0
+        self.count = 1
+
+    @property
+    def sharded(self):
+        return self.count > 1
+
+    def configure(self, index, count):
+        self.index = index
+        self.count = count
+
+    def of(self, key):
+        return 0 if key is None else abs(key) % self.count
+
+    def owns(self, key):
+        return self.of(key) == self.index
+
+
+def socket_path(index):
+    return os.path.join(SHARD_SOCKET_DIR, f"shard_{index}.sock")
+
+
+class ShardServer:
+    def __init__(self, index):
+        self.index = index
+        self.application = None
+        self.received = 0
+        self._server = None
+        self._writer = None
+
+    async def start(self, application):
+        self.application = application
+        application.update_processor.on_done = self.ack
+        path = socket_path(self.index)
+        os.makedirs(SHARD_SOCKET_DIR, exist_ok=True)
+        if os.path.exists(path):
+            os.remove(path)
+        self._server = await asyncio.start_unix_server(self._handle, path)
+        logger.info(f"Шард {self.index} принимает обновления через {path}")
+
+    async def stop(self):
+        if self.application is not None:
+            self.application.update_processor.on_done = None
+        if self._server is not None:
+            server, self._server = self._server, None
+            server.close()
+            await server.wait_closed()
+        try:
+            os.remove(socket_path(self.index))
+        except FileNotFoundError:
+            pass
+
+    def ack(self, update):
+        writer = self._writer
+        if writer is not None and not writer.is_closing():
+            writer.write(ACK.pack(update.update_id))
+
+    async def _handle(self, reader, writer):
+        self._writer = writer
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_HEADER.size)
+                body = await reader.readexactly(FRAME_HEADER.unpack(header)[0])
+                try:
+                    update = Update.de_json(json.loads(body), self.application.bot)
+                except Exception as e:
+                    logger.error(f"Не удалось разобрать обновление от фронта: {e}")
+                    continue
+                await self.application.update_queue.put(update)
+                self.received += 1
+        except (asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            if self._writer is writer:
+                self._writer = None
+            writer.close()
+
+
+class ShardRefresher:
+    def __init__(self, interval=SHARD_REFRESH_INTERVAL, retention=SHARD_CHANGES_RETENTION):
+        self.interval = interval
+        self.retention = retention
+        self.db = None
+        self.apply = None
+        self.reload = None
+        self.prune = False
+        self.watermark = 0
+        self.applied = 0
+        self.reloads = 0
+        self._pruned_at = None
+        self._task = None
+
+    async def start(self, database, apply=None, reload=None, prune=False):
+        if self._task is not None:
+            return
+        self.db = database
+        self.apply = apply
+        self.reload = reload
+        self.prune = prune
+        self.watermark = await database.get_shard_watermark()
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Ошибка при обновлении состояния шарда: {e}")
+
+    async def refresh(self):
+        if self.apply is not None:
+            await self._apply_changes()
+        if self.prune and (self._pruned_at is None or time.monotonic() - self._pruned_at >= SHARD_PRUNE_INTERVAL):
+            self._pruned_at = time.monotonic()
+            removed = await self.db.prune_shard_changes(self.retention)
+            if removed:
+                logger.info(f"Удалено старых записей журнала изменений: {removed}")
+
+    async def _apply_changes(self):
+        while True:
+            changes = await self.db.get_shard_changes(self.watermark, SHARD_CHANGES_BATCH)
+            if not changes:
+                return
+            if changes[0][0] > self.watermark + 1:
+                logger.warning(f"Журнал изменений очищен после {self.watermark}, полная перезагрузка состояния шарда")
+                self.watermark = await self.db.get_shard_watermark()
+                await self.reload()
+                self.reloads += 1
+                return
+            await self.apply(changes)
+            self.watermark = changes[-1][0]
+            self.applied += len(changes)
+            if len(changes) < SHARD_CHANGES_BATCH:
+                return
+
+
+class ShardRouter(WebhookIngress):
+    def __init__(self, secret, count, spawn):
+        super().__init__(secret)
+        self.shards = ShardInfo()
+        self.shards.configure(0, count)
+        self.spawn = spawn
+        self.routed = [0] * count
+        self.restarts = 0
+        self._processes = [None] * count
+        self._writers = [None] * count
+        self._ack_readers = [None] * count
+        self._unacked = [OrderedDict() for _ in range(count)]
+        self._supervisor = None
+
+    async def start(self):
+        for index in range(self.shards.count):
+            self._processes[index] = self.spawn(index)
+        await asyncio.gather(*(self._connect(index) for index in range(self.shards.count)))
+        self._supervisor = asyncio.create_task(self._supervise())
+
+    async def stop(self):
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            try:
+                await self._supervisor
+            except asyncio.CancelledError:
+                pass
+            self._supervisor = None
+        for index in range(self.shards.count):
+            self._disconnect(index)
+        processes = [process for process in self._processes if process is not None]
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGINT)
+        for process in processes:
+            await asyncio.to_thread(process.join, SHARD_STOP_TIMEOUT)
+            if process.is_alive():
+                logger.warning(f"Шард {process.name} не остановился вовремя, принудительное завершение")
+                process.terminate()
+                await asyncio.to_thread(process.join)
+
+    async def _connect(self, index):
+        deadline = asyncio.get_running_loop().time() + SHARD_CONNECT_TIMEOUT
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(socket_path(index))
+                self._writers[index] = writer
+                self._ack_readers[index] = asyncio.create_task(self._read_acks(index, reader))
+                for frame in self._unacked[index].values():
+                    writer.write(frame)
+                logger.info(f"Подключен шард {index}, повторно отправлено обновлений: {len(self._unacked[index])}")
+                return
+            except (FileNotFoundError, ConnectionRefusedError):
+                if asyncio.get_running_loop().time() > deadline:
+                    raise RuntimeError(f"Шард {index} не запустился за {SHARD_CONNECT_TIMEOUT} с")
+                await asyncio.sleep(0.2)
+
+    def _disconnect(self, index):
+        if self._ack_readers[index] is not None:
+            self._ack_readers[index].cancel()
+            self._ack_readers[index] = None
+        if self._writers[index] is not None:
+            self._writers[index].close()
+            self._writers[index] = None
+
+    async def _read_acks(self, index, reader):
+        unacked = self._unacked[index]
+        try:
+            while True:
+                update_id, = ACK.unpack(await reader.readexactly(ACK.size))
+                unacked.pop(update_id, None)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    async def _supervise(self):
+        while True:
+            await asyncio.sleep(SHARD_SUPERVISE_INTERVAL)
+            for index, process in enumerate(self._processes):
+                if process.is_alive():
+                    continue
+                await asyncio.to_thread(process.join)
+                logger.error(f"Шард {index} завершился с кодом {process.exitcode}, перезапуск")
+                self.restarts += 1
+                self._disconnect(index)
+                self._processes[index] = self.spawn(index)
+                try:
+                    await self._connect(index)
+                except Exception as e:
+                    logger.error(f"Не удалось переподключить шард {index}: {e}")
+
+    def route(self, data):
+        try:
+            key = update_key(Update.de_json(data, None))
+        except Exception as e:
+            logger.error(f"Не удалось разобрать обновление от Telegram: {e}")
+            return 400
+        index = self.shards.of(key)
+        unacked = self._unacked[index]
+        writer = self._writers[index]
+        alive = writer is not None and not writer.is_closing()
+        if len(unacked) >= SHARD_UNACKED_LIMIT or alive and writer.transport.get_write_buffer_size() > SHARD_BUFFER_LIMIT:
+            self.dropped += 1
+            return 503
+        body = json.dumps(data).encode()
+        frame = FRAME_HEADER.pack(len(body)) + body
+        unacked[data['update_id']] = frame
+        if alive:
+            writer.write(frame)
+        self.routed[index] += 1
+        self.received += 1
+        return 200
+
+    def accept(self, token, body):
+        if not self.check_secret(token):
+            self.rejected += 1
+            return 403
+        try:
+            data = json.loads(body)
+        except ValueError:
+            return 400
+        return self.route(data)
+
+    async def poll(self, bot):
+        offset = None
+        backoff = 1.0
+        while True:
+            try:
+                updates = await bot.get_updates(offset=offset, timeout=POLL_TIMEOUT, allowed_updates=Update.ALL_TYPES)
+            except RetryAfter as e:
+                delay = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                logger.warning(f"Telegram просит подождать {delay} с перед следующим запросом обновлений")
+                await asyncio.sleep(delay)
+                continue
+            except TimedOut:
+                continue
+            except TelegramError as e:
+                logger.error(f"Ошибка при получении обновлений, повтор через {backoff:.0f} с: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, POLL_BACKOFF_MAX)
+                continue
+            backoff = 1.0
+            for update in updates:
+                while self.route(update.to_dict()) == 503:
+                    await asyncio.sleep(0.1)
+                offset = update.update_id + 1
+
+    def stats(self):
+        return {
+            "shards": self.shards.count,
+            "routed": self.routed,
+            "received": self.received,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "restarts": self.restarts,
+            "unacked": [len(unacked) for unacked in self._unacked],
+            "alive": [process is not None and process.is_alive() for process in self._processes],
+        }
+
+
+shard = ShardInfo()
+shard_refresher = ShardRefresher()
@@ -0,0 +1,64 @@
+import sqlite3
+
+import migrations
+
+
+def make_baseline_db(path, users):
+    conn = sqlite3.connect(path, isolation_level=None)
+    migrations._initial_schema(conn)
+    conn.executemany(
+        "INSERT INTO users (user_id, first_name, is_active, is_approved) VALUES (?, ?, ?, ?)",
+        users
+    )
+    conn.close()
+
+
+def test_backfill_sparse_large_ids(tmp_path):
+    path = str(tmp_path / 'sparse.db')
+    make_baseline_db(path, [
+        (5, 'Аня', 1, 0),
+        (5123456789, 'Борис', 1, 0),
+        (7000000000, 'Вера', 1, 1),
+    ])
+
+    migrations.run_migrations(path)
+
+    conn = sqlite3.connect(path)
+    flags = dict(conn.execute("SELECT user_id, is_under_review FROM users"))
+    conn.close()
+    assert flags == {5: 1, 5123456789: 1, 7000000000: 0}
+
+
+def test_backfill_transactions_follow_matching_rows(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'transactions.db'), isolation_level=None)
+    conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, flag INTEGER DEFAULT 0)")
+    conn.executemany("INSERT INTO items (id) VALUES (?)", [(5,), (5123456789,), (7000000000,)])
+    statements = []
+    conn.set_trace_callback(statements.append)
+
+    updated = migrations.backfill(conn, 'items', 'flag = 1', "flag = 0", chunk_size=2)
+
+    assert updated == 3
+    assert statements.count("BEGIN IMMEDIATE") == 3
+    conn.close()
+
+
+def test_backfill_walks_every_chunk(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'chunks.db'), isolation_level=None)
+    conn.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, flag INTEGER DEFAULT 0)")
+    ids = [i * 1000003 for i in range(1, 26)]
+    conn.executemany("INSERT INTO items (id) VALUES (?)", [(i,) for i in ids])
+
+    updated = migrations.backfill(conn, 'items', 'flag = 1', "flag = 0 AND id % 2 = ?", (1,), chunk_size=4)
+
+    assert updated == sum(1 for i in ids if i % 2 == 1)
+    flagged = {row[0] for row in conn.execute("SELECT id FROM items WHERE flag = 1")}
+    assert flagged == {i for i in ids if i % 2 == 1}
+    conn.close()
+
+
+def test_hot_queries_use_indexes(tmp_path):
+    path = str(tmp_path / 'plans.db')
+    migrations.run_migrations(path)
+
+    assert migrations.check_query_plans(path) == []
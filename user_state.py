@@ -0,0 +1,160 @@
+import asyncio
+import json
+from copy import deepcopy
+import logging
+import time
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+USER_STATE_UPDATE_INTERVAL = 10
+USER_STATE_IDLE_SECONDS = 1800.0
+USER_STATE_EVICT_INTERVAL = 300.0
+
+
+def encode_state(data):
+    encoded = {}
+    for key, value in data.items():
+        try:
+            encoded[key] = json.dumps(value, ensure_ascii=False, sort_keys=True)
+        except (TypeError, ValueError):
+            logger.warning(f"Значение user_data[{key!r}] нельзя сохранить, пропускаю")
+    return encoded
+
+
+class SQLitePersistence(BasePersistence):
+    def __init__(self, database, update_interval=USER_STATE_UPDATE_INTERVAL, idle=USER_STATE_IDLE_SECONDS):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.db = database
+        self.idle = idle
+        self.application = None
+        self.loads = 0
+        self.writes = 0
+        self.evictions = 0
+        self._snapshots = {}
+        self._last_seen = {}
+        self._evicted = set()
+        self._evictor = None
+
+    async def start(self, application):
+        self.application = application
+        if self._evictor is None:
+            self._evictor = asyncio.create_task(self._evict_loop())
+
+    async def stop(self):
+        if self._evictor is not None:
+            self._evictor.cancel()
+            try:
+                await self._evictor
+            except asyncio.CancelledError:
+                pass
+            self._evictor = None
+
+    async def _load(self, user_id):
+        snapshot = self._snapshots.get(user_id)
+        if snapshot is None:
+            snapshot = self._snapshots[user_id] = dict(await self.db.get_user_state(user_id))
+            self.loads += 1
+        return snapshot
+
+    async def get_user_data(self):
+        return {}
+
+    async def refresh_user_data(self, user_id, user_data):
+        self._last_seen[user_id] = time.monotonic()
+        if user_id in self._snapshots:
+            return
+        for key, value in (await self._load(user_id)).items():
+            user_data.setdefault(key, json.loads(value))
+
+    async def update_user_data(self, user_id, data):
+        snapshot = await self._load(user_id)
+        current = encode_state(data)
+        changed = [(user_id, key, value) for key, value in current.items() if snapshot.get(key) != value]
+        removed = [(user_id, key) for key in snapshot if key not in current]
+        if not changed and not removed:
+            return
+        await self.db.save_user_state(changed, removed)
+        self._snapshots[user_id] = current
+        self.writes += len(changed) + len(removed)
+
+    async def drop_user_data(self, user_id):
+        if user_id in self._evicted:
+            self._evicted.discard(user_id)
+            if user_id in self._snapshots and self.application is not None and user_id in self.application.user_data:
+                await self.update_user_data(user_id, deepcopy(self.application.user_data[user_id]))
+            return
+        self._snapshots.pop(user_id, None)
+        self._last_seen.pop(user_id, None)
+        await self.db.delete_user_state(user_id)
+
+    async def _evict_loop(self):
+        while True:
+            await asyncio.sleep(USER_STATE_EVICT_INTERVAL)
+            try:
+                self.evict()
+            except Exception as e:
+                logger.error(f"Ошибка при выгрузке неактивных user_data: {e}")
+
+    def evict(self):
+        now = time.monotonic()
+        evicted = 0
+        for user_id, last_seen in list(self._last_seen.items()):
+            if now - last_seen < self.idle:
+                continue
+            data = self.application.user_data.get(user_id, {})
+            if encode_state(data) != self._snapshots.get(user_id, {}):
+                continue
+            del self._last_seen[user_id]
+            self._snapshots.pop(user_id, None)
+            self._evicted.add(user_id)
+            self.application.drop_user_data(user_id)
+            evicted += 1
+        if evicted:
+            self.evictions += evicted
+            logger.info(f"Выгружено неактивных user_data: {evicted}")
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def get_conversations(self, name):
+        return {}
+
+    async def update_conversation(self, name, key, new_state):
+        pass
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def flush(self):
+        pass
+
+
+user_state = SQLitePersistence(db)
@@ -0,0 +1,74 @@
+import logging
+from datetime import datetime
+
+from aiohttp import web
+
+from webhook import SECRET_HEADER
+
+logger = logging.getLogger(__name__)
+
+HTTP_HOST = '0.0.0.0'
+HTTP_PORT = 8080
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 8081
+
+
+class WebServer:
+    def __init__(self, ingress, metrics, host=HTTP_HOST, port=HTTP_PORT, metrics_host=METRICS_HOST, metrics_port=METRICS_PORT):
+        self.ingress = ingress
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self.metrics_host = metrics_host
+        self.metrics_port = metrics_port
+        self._runners = []
+
+    def build(self):
+        app = web.Application()
+        app.add_routes([
+            web.get('/', self.home),
+            web.get('/health', self.health),
+            web.post('/webhook', self.webhook),
+        ])
+        return app
+
+    def build_metrics(self):
+        app = web.Application()
+        app.add_routes([web.get('/metrics', self.metrics_view)])
+        return app
+
+    async def start(self):
+        if self._runners:
+            return
+        sites = [
+            (self.build(), self.host, self.port),
+            (self.build_metrics(), self.metrics_host, self.metrics_port),
+        ]
+        try:
+            for app, host, port in sites:
+                runner = web.AppRunner(app, access_log=None)
+                await runner.setup()
+                self._runners.append(runner)
+                await web.TCPSite(runner, host, port).start()
+                logger.info(f"HTTP сервер запущен на {host}:{port}")
+        except Exception:
+            await self.stop()
+            raise
+
+    async def stop(self):
+        runners, self._runners = self._runners, []
+        for runner in runners:
+            await runner.cleanup()
+
+    async def home(self, request):
+        return web.Response(text="Бот знакомств работает! 🚀")
+
+    async def health(self, request):
+        return web.json_response({"status": "ok", "timestamp": datetime.now().isoformat()})
+
+    async def webhook(self, request):
+        status = self.ingress.accept(request.headers.get(SECRET_HEADER), await request.read())
+        return web.json_response({"ok": status == 200}, status=status)
+
+    async def metrics_view(self, request):
+        return web.json_response(self.metrics())
@@ -0,0 +1,56 @@
+import hmac
+import json
+import logging
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_QUEUE_SIZE = 1000
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookIngress:
+    def __init__(self, secret, url=''):
+        self.secret = secret
+        self.url = url
+        self.application = None
+        self.received = 0
+        self.rejected = 0
+        self.dropped = 0
+
+    def attach(self, application):
+        self.application = application
+
+    def detach(self):
+        self.application = None
+
+    async def start(self, application):
+        await application.bot.set_webhook(self.url, secret_token=self.secret, allowed_updates=Update.ALL_TYPES)
+        self.attach(application)
+        logger.info(f"Вебхук установлен: {self.url}")
+
+    async def stop(self):
+        self.detach()
+
+    def check_secret(self, token):
+        return bool(self.secret) and hmac.compare_digest((token or '').encode(), self.secret.encode())
+
+    def accept(self, token, body):
+        if not self.check_secret(token):
+            self.rejected += 1
+            return 403
+        application = self.application
+        if application is None:
+            return 503
+        if application.update_queue.full():
+            self.dropped += 1
+            return 503
+        try:
+            update = Update.de_json(json.loads(body), application.bot)
+        except Exception as e:
+            logger.error(f"Не удалось разобрать обновление от Telegram: {e}")
+            return 400
+        application.update_queue.put_nowait(update)
+        self.received += 1
+        return 200